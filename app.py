@@ -3,28 +3,212 @@ Minimal LTI 1.3 Tool for OpenEdX
 Flask application with PyLTI1p3 integration
 """
 
+from contextlib import nullcontext
+import hmac
+import json
+import logging
 import os
 
-from flask import Flask, jsonify, render_template, request, session, url_for
+from flask import (
+    Flask,
+    Response,
+    before_render_template,
+    jsonify,
+    render_template,
+    request,
+    session,
+    stream_template,
+    template_rendered,
+    url_for,
+)
+from flask.logging import default_handler
 from flask_session import Session
-from pylti1p3.contrib.flask import FlaskMessageLaunch, FlaskOIDCLogin, FlaskRequest
-from pylti1p3.exception import LtiException
+from pylti1p3.contrib.flask import FlaskRequest
+from pylti1p3.exception import LtiException, LtiServiceException
 from pylti1p3.tool_config import ToolConfJsonFile
+import requests
 
 from config import Config
-from utils.lti_utils import get_course_info, get_launch_data_storage, get_user_info
+from utils.admission import (
+    THROTTLE_STATUSES,
+    AdmissionRejected,
+    OutboundSlot,
+    create_admission_controller,
+    get_client_key,
+)
+from utils.grade_ledger import GradeLedger
+from utils.grade_token import (
+    GRADEBOOK_USE,
+    GradeTokenError,
+    get_ags_from_grade_token,
+    get_service_connector_from_grade_token,
+    issue_grade_token,
+    verify_grade_token,
+)
+from utils.gradebook import Gradebook, invalidate_results
+from utils.health import (
+    LIVENESS_BODY,
+    HealthMonitor,
+    SkipPathsSessionInterface,
+    key_material_check,
+    launch_storage_check,
+    platform_check,
+    session_store_check,
+)
+from utils.lti_utils import (
+    ReplayProtectedOIDCLogin,
+    TracedFlaskMessageLaunch,
+    get_course_info,
+    get_launch_data_storage,
+    get_user_info,
+)
+from utils.redis_client import get_redis_client
+from utils.replay_store import create_replay_store
+from utils.resilience import clear_deadline, create_platform_session, set_deadline
+from utils.tenancy import create_tenant_caches, load_tenant_registry, tenant_stats
+from utils.tracing import (
+    TracedSessionInterface,
+    TraceIdFilter,
+    TracingMiddleware,
+    configure_tracer,
+    tracer,
+)
+from utils.traffic_recorder import TrafficRecorder
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Configure session
+# Request tracing: root span per request, trace id on every log record
+configure_tracer(app.config)
+app.wsgi_app = TracingMiddleware(app.wsgi_app, tracer)
+app.logger.addFilter(TraceIdFilter())
+default_handler.setFormatter(
+    logging.Formatter("[%(asctime)s] %(levelname)s in %(module)s [trace=%(trace_id)s]: %(message)s")
+)
+
+# Opt-in capture of redacted launch/grading traffic for replay
+if app.config["TRAFFIC_RECORD_ENABLED"]:
+    app.wsgi_app = TrafficRecorder(
+        app.wsgi_app,
+        app.config["TRAFFIC_RECORD_FILE"],
+        app.config["SECRET_KEY"],
+        max_bytes=app.config["TRAFFIC_RECORD_MAX_BYTES"],
+    )
+
+# Configure session; Redis sessions use the worker's shared pooled client
+if app.config["SESSION_TYPE"] == "redis":
+    app.config["SESSION_REDIS"] = get_redis_client(app.config)
 Session(app)
 
+# Probe endpoints and grading (authenticated by its grade token) never open
+# or save a session, even though the browser sends the session cookie
+app.session_interface = TracedSessionInterface(
+    SkipPathsSessionInterface(
+        app.session_interface, ("/healthz", "/readyz", "/submit_grade")
+    )
+)
 
 def get_lti_config_path():
     """Get the path to the LTI configuration file"""
-    return os.path.join(os.path.dirname(__file__), "configs", "lti_config.json")
+    return app.config["LTI_CONFIG_FILE"]
+
+
+def load_tool_config_dict():
+    """Load the raw LTI configuration, or an empty dict if it is missing"""
+    try:
+        with open(get_lti_config_path(), encoding="utf-8") as config_file:
+            return json.load(config_file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Per-issuer weights, connection pool sizes and cache quotas
+tenants = load_tenant_registry(app.config, load_tool_config_dict())
+
+# Admission control for the grading path (None when disabled)
+admission = create_admission_controller(app.config, tenants)
+
+# Shared outbound session for platform calls (circuit breakers, deadlines,
+# one connection pool per platform host). Key set fetches, including the
+# readiness probe's, take a tenant slot when one is free
+platform_session = create_platform_session(
+    app.config,
+    load_tool_config_dict(),
+    tenants,
+    slot_for=admission.background_slot if admission else None,
+)
+
+# Append-only record of every grade submission outcome
+grade_ledger = GradeLedger(
+    app.config["GRADE_LEDGER_DB"],
+    batch_size=app.config["GRADE_LEDGER_BATCH_SIZE"],
+    flush_interval=app.config["GRADE_LEDGER_FLUSH_INTERVAL"],
+)
+
+# Caches shared by all workers, one quota-bounded partition per issuer:
+# gradebook results/roster, platform access tokens
+tenant_caches = create_tenant_caches(app.config, tenants)
+TracedFlaskMessageLaunch.token_caches = tenant_caches
+TracedFlaskMessageLaunch.token_ttl = app.config["ACCESS_TOKEN_CACHE_TTL"]
+
+# Single-use OIDC states and nonces, kept out of the session
+replay_store = create_replay_store(app.config)
+ReplayProtectedOIDCLogin.replay_store = replay_store
+TracedFlaskMessageLaunch.replay_store = replay_store
+
+# Background dependency probes backing /readyz
+health_monitor = HealthMonitor(
+    {
+        "session_store": session_store_check(app),
+        "launch_storage": launch_storage_check(app),
+        "key_material": key_material_check(get_lti_config_path()),
+        "platforms": platform_check(platform_session, load_tool_config_dict()),
+    },
+    interval=app.config["HEALTH_PROBE_INTERVAL"],
+    critical=("session_store", "launch_storage", "key_material"),
+)
+# Probe from startup so the first /readyz never waits on a platform call
+health_monitor.ensure_started()
+
+
+@before_render_template.connect_via(app)
+def start_template_span(sender, template, context, **extra):
+    """Open a span for each template render"""
+    context["_render_span"] = tracer.start_span("template.render", template=template.name)
+
+
+@template_rendered.connect_via(app)
+def finish_template_span(sender, template, context, **extra):
+    """Close the template render span"""
+    span = context.get("_render_span")
+    if span is not None:
+        tracer.finish_span(span)
+
+
+@app.before_request
+def start_request_deadline():
+    """Bound all outbound platform calls made while serving this request"""
+    set_deadline(app.config["REQUEST_DEADLINE"])
+
+
+@app.teardown_request
+def end_request_deadline(exc):
+    """Drop the request deadline once the response is done"""
+    clear_deadline()
+
+
+def platform_unavailable_response(error):
+    """Build a 503 response carrying Retry-After for an unreachable platform"""
+    retry_after = max(1, int(getattr(error, "retry_after", 0) or 5))
+    app.logger.warning(f"Platform unavailable: {str(error)}")
+    response = jsonify({
+        "error": "Open edX is temporarily unreachable. Please try again shortly.",
+        "retry_after": retry_after,
+    })
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
 
 
 @app.route("/")
@@ -49,12 +233,13 @@ def login():
             target_link_uri = url_for("launch", _external=True)
 
         # Initialize OIDC login
-        oidc_login = FlaskOIDCLogin(
+        oidc_login = ReplayProtectedOIDCLogin(
             flask_request, tool_conf, launch_data_storage=get_launch_data_storage()
         )
 
         # Redirect to platform's authentication endpoint
-        return oidc_login.redirect(target_link_uri)
+        with tracer.span("oidc.login"):
+            return oidc_login.redirect(target_link_uri)
 
     except Exception as e:
         app.logger.error(f"Login error: {str(e)}")
@@ -74,8 +259,11 @@ def launch():
         flask_request = FlaskRequest()
 
         # Initialize and validate the message launch
-        message_launch = FlaskMessageLaunch(
-            flask_request, tool_conf, launch_data_storage=get_launch_data_storage()
+        message_launch = TracedFlaskMessageLaunch(
+            flask_request,
+            tool_conf,
+            launch_data_storage=get_launch_data_storage(),
+            requests_session=platform_session,
         )
 
         # Get launch data
@@ -109,8 +297,29 @@ def launch():
 
         # Check AGS availability
         has_ags = message_launch.has_ags()
+        grade_token = gradebook_token = None
         if has_ags:
             app.logger.info("✓ AGS is available for this launch")
+            # Issue a stateless grade token so grading needs no session lookup
+            grade_token = issue_grade_token(
+                app.config["SECRET_KEY"],
+                message_launch,
+                user_info.get("user_id"),
+                course_info.get("course_id"),
+                app.config["GRADE_TOKEN_TTL"],
+                is_instructor=user_info.get("is_instructor", False),
+            )
+            if user_info.get("is_instructor"):
+                # Gradebook access gets its own short-lived token that cannot grade
+                gradebook_token = issue_grade_token(
+                    app.config["SECRET_KEY"],
+                    message_launch,
+                    user_info.get("user_id"),
+                    course_info.get("course_id"),
+                    app.config["GRADEBOOK_TOKEN_TTL"],
+                    is_instructor=True,
+                    use=GRADEBOOK_USE,
+                )
         else:
             app.logger.warning("✗ AGS not available for this launch")
 
@@ -132,11 +341,26 @@ def launch():
             launch_nonce=launch_data.get("nonce", "N/A"),
             timestamp=datetime.now().isoformat(),
             has_ags=has_ags,
+            grade_token=grade_token,
+            gradebook_token=gradebook_token,
         )
 
-    except LtiException as e:
-        app.logger.error(f"LTI launch error: {str(e)}")
+    except (LtiException, requests.exceptions.RequestException) as e:
         from datetime import datetime
+        # PyLTI1p3 wraps key set fetch failures ("Error during fetch URL") in
+        # LtiException; surface any unreachable platform as 503
+        platform_error = e if isinstance(e, requests.exceptions.RequestException) else e.__cause__
+        if isinstance(platform_error, requests.exceptions.RequestException):
+            retry_after = max(1, int(getattr(platform_error, "retry_after", 0) or 5))
+            app.logger.warning(f"Platform unavailable during launch: {str(platform_error)}")
+            return render_template(
+                "error.html",
+                error_message="Open edX is temporarily unreachable",
+                error_details="Please try launching the tool again in a moment.",
+                timestamp=datetime.now().isoformat()
+            ), 503, {"Retry-After": str(retry_after)}
+
+        app.logger.error(f"LTI launch error: {str(e)}")
         return render_template(
             "error.html",
             error_message="Invalid LTI launch",
@@ -229,95 +453,304 @@ def api_status():
     )
 
 
+def rate_limited_response(rejection):
+    """Build a 429 response carrying Retry-After for a rejected request"""
+    app.logger.warning(
+        f"Grade submission rejected: {rejection.reason} (retry in {rejection.retry_after}s)"
+    )
+    response = jsonify({"error": rejection.reason, "retry_after": rejection.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(rejection.retry_after)
+    return response
+
+
+def record_grade_outcome(grade_context, score, max_score, comment, outcome,
+                         status_code, error=None):
+    """Append a submit_grade outcome to the grade ledger"""
+    if grade_context is None:
+        return
+    try:
+        grade_ledger.record(
+            issuer=grade_context.get("iss"),
+            course_id=grade_context.get("course_id"),
+            user_id=grade_context.get("sub"),
+            score=score,
+            max_score=max_score,
+            comment=comment,
+            outcome=outcome,
+            status_code=status_code,
+            error=error,
+            lineitem=(grade_context.get("ags") or {}).get("lineitem"),
+        )
+    except Exception as e:
+        app.logger.error(f"Failed to record grade in ledger: {str(e)}")
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """
+    Liveness probe
+    Constant pre-serialized response; no session, storage or platform I/O
+    """
+    return Response(LIVENESS_BODY, mimetype="application/json")
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness probe
+    Reports session store, launch storage, key material and platform
+    reachability from the latest background probe run
+    """
+    body, status_code = health_monitor.snapshot()
+    return Response(body, status=status_code, mimetype="application/json")
+
+
+@app.route("/api/status/platforms", methods=["GET"])
+def api_status_platforms():
+    """
+    Circuit breaker state for each platform host contacted by this worker
+    """
+    return jsonify({"status": "ok", "circuits": platform_session.breaker_states()})
+
+
+@app.route("/api/status/tenants", methods=["GET"])
+def api_status_tenants():
+    """
+    Per-platform weights, grading slot usage and latency
+
+    Slot usage ("held", "queued") covers all workers; latency and wait
+    percentiles are for this worker only.
+    """
+    stats = tenant_stats.snapshot()
+    queue_depths = admission.queue_depths() if admission else {}
+    issuers = set(tenants.settings) | set(tenants.hosts().values())
+    issuers |= set(stats) | set(queue_depths)
+
+    report = {}
+    for issuer in sorted(issuers):
+        report[issuer] = {
+            "tenant_id": tenants.tenant_id(issuer),
+            "weight": tenants.weight(issuer),
+            "pool_size": int(tenants.setting(issuer, "pool_size")),
+            "cache_quota": int(tenants.setting(issuer, "cache_quota")),
+            "slots": queue_depths.get(issuer, {"held": 0, "queued": 0}),
+            "latency": stats.get(issuer, {}),
+        }
+    return jsonify({"status": "ok", "pid": os.getpid(), "tenants": report})
+
+
+def get_ledger_course_scope():
+    """
+    Resolve which courses the caller may read from the grade ledger
+
+    Admins authenticate with the LEDGER_ADMIN_TOKEN bearer token and may pick
+    any course (or all). Instructors are limited to their launched course.
+
+    Returns:
+        tuple: (is_allowed, course_id or None for all courses)
+    """
+    admin_token = app.config.get("LEDGER_ADMIN_TOKEN")
+    authorization = request.headers.get("Authorization", "")
+    if admin_token and hmac.compare_digest(authorization, f"Bearer {admin_token}"):
+        return True, request.args.get("course_id")
+
+    if session.get("is_instructor"):
+        return True, session.get("course_id")
+
+    return False, None
+
+
+@app.route("/api/grades", methods=["GET"])
+def api_grades():
+    """
+    Page through recorded grade submissions
+    Keyset pagination: pass next_cursor back as ?after= to get the next page
+    """
+    is_allowed, course_id = get_ledger_course_scope()
+    if not is_allowed:
+        return jsonify({"error": "Instructor or admin access required"}), 403
+
+    try:
+        limit = min(int(request.args.get("limit", 100)), 500)
+        rows, next_cursor = grade_ledger.query(
+            course_id=course_id,
+            user_id=request.args.get("user_id"),
+            after=request.args.get("after"),
+            limit=max(limit, 1),
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+
+    return jsonify({"grades": rows, "next_cursor": next_cursor})
+
+
+@app.route("/api/grades/export.csv", methods=["GET"])
+def api_grades_export():
+    """
+    Stream recorded grade submissions as CSV, one row at a time
+    """
+    is_allowed, course_id = get_ledger_course_scope()
+    if not is_allowed:
+        return jsonify({"error": "Instructor or admin access required"}), 403
+
+    filename = f"grades-{course_id or 'all'}.csv".replace('"', "")
+    return Response(
+        grade_ledger.iter_csv(course_id=course_id, user_id=request.args.get("user_id")),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.route("/instructor/gradebook", methods=["POST"])
+def instructor_gradebook():
+    """
+    Instructor gradebook
+    Streams the line item's AGS results joined with the course roster
+
+    The gradebook token is posted as a form field so it never appears in
+    URLs, access logs, browser history or Referer headers.
+    """
+    from datetime import datetime
+
+    try:
+        claims = verify_grade_token(
+            app.config["SECRET_KEY"], request.form.get("token", ""), use=GRADEBOOK_USE
+        )
+    except GradeTokenError as e:
+        return render_template(
+            "error.html",
+            error_message="Gradebook unavailable",
+            error_details=f"{str(e)}. Please relaunch the tool from Open edX.",
+            timestamp=datetime.now().isoformat()
+        ), 401
+
+    if not claims.get("instructor"):
+        return render_template(
+            "error.html",
+            error_message="Access Forbidden",
+            error_details="Only instructors can view the gradebook.",
+        ), 403
+
+    tool_conf = ToolConfJsonFile(get_lti_config_path())
+    issuer_cache = tenant_caches.for_issuer(claims["iss"])
+    try:
+        service_connector = get_service_connector_from_grade_token(
+            claims, tool_conf, platform_session,
+            issuer_cache, app.config["ACCESS_TOKEN_CACHE_TTL"],
+        )
+    except GradeTokenError as registration_error:
+        app.logger.error(f"✗ Gradebook token rejected: {str(registration_error)}")
+        return jsonify({
+            "error": f"{str(registration_error)}. Please relaunch the tool from Open edX."
+        }), 401
+    gradebook = Gradebook(
+        issuer_cache,
+        service_connector,
+        claims["ags"],
+        memberships_url=claims.get("nrps"),
+        results_ttl=app.config["GRADEBOOK_RESULTS_TTL"],
+        roster_ttl=app.config["GRADEBOOK_ROSTER_TTL"],
+        fetch_slot=(
+            (lambda: admission.outbound_slot(claims["iss"], kind="refresh"))
+            if admission else None
+        ),
+    )
+    if not gradebook.can_read_results():
+        return render_template(
+            "error.html",
+            error_message="Gradebook unavailable",
+            error_details="The platform did not grant the AGS result.readonly scope for this line item.",
+        ), 403
+
+    return Response(
+        stream_template(
+            "gradebook.html", rows=gradebook.iter_rows(), course_id=claims.get("course_id")
+        ),
+        mimetype="text/html",
+    )
+
+
 @app.route("/submit_grade", methods=["POST"])
 def submit_grade():
     """
     Submit a grade back to Open edX via AGS (Assignment and Grade Services)
 
-    This endpoint accepts launch_id and user_id from both the request body and session.
-    This is important for iframe contexts where session cookies may be blocked by browsers,
-    especially on free hosting tiers without persistent Redis sessions.
+    The only accepted credential is the signed grade_token issued at launch.
+    It is verified with a single HMAC check, so grading needs no session store
+    or launch cache and works when session cookies are blocked in iframes. The
+    grade is always submitted for the token's subject; a request naming any
+    other user is rejected.
     """
     from datetime import datetime
 
     from pylti1p3.grade import Grade
 
+    grade_context = score = max_score = comment = None
     try:
         app.logger.info("=" * 80)
         app.logger.info("GRADE SUBMISSION REQUEST RECEIVED")
         app.logger.info("=" * 80)
-        
+
+
         # Get parameters from request
         data = request.get_json()
-        app.logger.info(f"Request data: {data}")
-        
+
         score = float(data.get("score"))
         max_score = float(data.get("max_score", 100))
-        comment = data.get("comment", "")
+        comment = data.get("comment")
+        if comment is None:
+            comment = ""
+        body_user_id = data.get("user_id")
+        if not isinstance(comment, str) or not isinstance(body_user_id, (str, type(None))):
+            app.logger.error("Grade submission with a non-string comment or user_id")
+            return jsonify({"error": "comment and user_id must be strings"}), 400
         app.logger.info(f"Parsed grade data - Score: {score}/{max_score}, Comment: '{comment}'")
 
-        # Get launch_id from request body (fallback) or session
-        # This allows the endpoint to work even if cookies are blocked in iframes
-        launch_id = data.get("launch_id") or session.get("launch_id")
-        user_id = data.get("user_id") or session.get("user_id")
-        
-        app.logger.info(f"Authentication - launch_id: {launch_id}, user_id: {user_id}")
-        app.logger.info(f"Session data: {dict(session)}")
-
-        if not launch_id or not user_id:
-            app.logger.error(f"Missing authentication data. launch_id: {launch_id}, user_id: {user_id}")
-            return jsonify({
-                "error": "Not authenticated or no launch data. Please relaunch the tool from Open edX."
-            }), 401
-
         # Validate score
         if score < 0 or score > max_score:
             app.logger.error(f"Invalid score: {score} not in range [0, {max_score}]")
             return jsonify({"error": "Invalid score value"}), 400
 
-        # Retrieve stored launch data
-        app.logger.info("Attempting to retrieve cached launch data...")
-        tool_conf = ToolConfJsonFile(get_lti_config_path())
-        flask_request = FlaskRequest()
-        
-        app.logger.info(f"Tool config loaded from: {get_lti_config_path()}")
-        app.logger.info(f"Using launch_id: {launch_id}")
-
+        # The signed grade token issued at launch carries the AGS endpoint and
+        # user id, so no client-supplied ids are trusted
+        grade_token = data.get("grade_token")
+        if not grade_token:
+            app.logger.error("✗ Grade submission without a grade token")
+            return jsonify({
+                "error": "Missing grade token. Please relaunch the tool from Open edX."
+            }), 401
         try:
-            message_launch = FlaskMessageLaunch.from_cache(
-                launch_id, flask_request, tool_conf, launch_data_storage=get_launch_data_storage()
-            )
-            app.logger.info("✓ Successfully retrieved launch data from cache")
-        except Exception as cache_error:
-            app.logger.error(f"✗ Failed to retrieve launch data from cache: {str(cache_error)}")
-            app.logger.error(f"Cache error type: {type(cache_error).__name__}")
-            import traceback
-            app.logger.error(f"Traceback: {traceback.format_exc()}")
+            claims = verify_grade_token(app.config["SECRET_KEY"], grade_token)
+        except GradeTokenError as token_error:
+            app.logger.error(f"✗ Grade token rejected: {str(token_error)}")
             return jsonify({
-                "error": f"Failed to retrieve launch data. The session may have expired. Error: {str(cache_error)}"
-            }), 400
+                "error": f"{str(token_error)}. Please relaunch the tool from Open edX."
+            }), 401
 
-        # Check AGS availability
-        app.logger.info("Checking AGS availability...")
-        has_ags = message_launch.has_ags()
-        app.logger.info(f"AGS available: {has_ags}")
-        
-        if not has_ags:
-            app.logger.error("AGS not available for this launch")
-            return jsonify(
-                {"error": "AGS not available for this launch. Ensure the tool is configured as graded in Open edX."}
-            ), 400
+        if body_user_id not in (None, claims["sub"]):
+            app.logger.error(
+                f"✗ Grade submission for user {body_user_id} with a token for {claims['sub']}"
+            )
+            return jsonify({"error": "Grade token does not belong to this user"}), 403
+        grade_context = claims
 
-        # Get AGS service
-        app.logger.info("Getting AGS service...")
+        tool_conf = ToolConfJsonFile(get_lti_config_path())
         try:
-            ags = message_launch.get_ags()
-            app.logger.info(f"✓ AGS service retrieved: {ags}")
-        except Exception as ags_error:
-            app.logger.error(f"✗ Failed to get AGS service: {str(ags_error)}")
-            import traceback
-            app.logger.error(f"Traceback: {traceback.format_exc()}")
-            return jsonify({"error": f"Failed to get AGS service: {str(ags_error)}"}), 500
+            ags = get_ags_from_grade_token(
+                claims, tool_conf, platform_session,
+                tenant_caches.for_issuer(claims["iss"]),
+                app.config["ACCESS_TOKEN_CACHE_TTL"],
+            )
+        except GradeTokenError as registration_error:
+            app.logger.error(f"✗ Grade token rejected: {str(registration_error)}")
+            return jsonify({
+                "error": f"{str(registration_error)}. Please relaunch the tool from Open edX."
+            }), 401
+        app.logger.info(f"✓ Grade token verified for user {claims['sub']}")
+
+        user_id = grade_context["sub"]
+        issuer = grade_context["iss"]
 
         # Check permissions
         app.logger.info("Checking AGS permissions...")
@@ -326,6 +759,8 @@ def submit_grade():
         
         if not can_put:
             app.logger.error("No permission to submit grades")
+            record_grade_outcome(grade_context, score, max_score, comment,
+                                 "forbidden", 403, "Missing required AGS scope")
             return jsonify(
                 {"error": "No permission to submit grades. Missing required AGS scope."}
             ), 403
@@ -348,14 +783,46 @@ def submit_grade():
         # Submit grade to Open edX
         app.logger.info(f"Submitting grade to Open edX: {score}/{max_score} for user {user_id}")
         try:
-            response = ags.put_grade(grade)
+            # Charges the client and platform budgets and takes a slot in one
+            # store round trip, only for requests that may actually submit
+            slot_context = (
+                admission.outbound_slot(issuer, client_key=get_client_key(claims))
+                if admission else nullcontext(OutboundSlot())
+            )
+            with slot_context as slot:
+                with tracer.span("ags.put_grade", lineitem=grade_context["ags"].get("lineitem")):
+                    try:
+                        response = ags.put_grade(grade)
+                    except LtiServiceException as service_error:
+                        # Releasing the slot adapts the platform's rate to this status
+                        slot.status_code = service_error.response.status_code
+                        raise
+                slot.status_code = 200
             app.logger.info("✓ Grade submission successful!")
             app.logger.info(f"Response: {response}")
+        except (AdmissionRejected, requests.exceptions.RequestException):
+            raise
         except Exception as submit_error:
+            if (
+                admission
+                and isinstance(submit_error, LtiServiceException)
+                and submit_error.response.status_code in THROTTLE_STATUSES
+            ):
+                retry_after = submit_error.response.headers.get("Retry-After", "5")
+                raise AdmissionRejected(
+                    "Open edX is throttling grade submissions",
+                    float(retry_after) if retry_after.isdigit() else 5,
+                ) from submit_error
             app.logger.error(f"✗ Grade submission failed: {str(submit_error)}")
             app.logger.error(f"Error type: {type(submit_error).__name__}")
             import traceback
             app.logger.error(f"Traceback: {traceback.format_exc()}")
+            platform_status = (
+                submit_error.response.status_code
+                if isinstance(submit_error, LtiServiceException) else None
+            )
+            record_grade_outcome(grade_context, score, max_score, comment,
+                                 "failed", platform_status, str(submit_error))
             return jsonify({
                 "error": f"Failed to submit grade to Open edX: {str(submit_error)}"
             }), 500
@@ -363,6 +830,10 @@ def submit_grade():
         app.logger.info("=" * 80)
         app.logger.info("GRADE SUBMISSION COMPLETED SUCCESSFULLY")
         app.logger.info("=" * 80)
+        record_grade_outcome(grade_context, score, max_score, comment, "submitted", 200)
+        invalidate_results(
+            tenant_caches.for_issuer(issuer), (grade_context.get("ags") or {}).get("lineitem")
+        )
 
         return jsonify(
             {
@@ -374,6 +845,16 @@ def submit_grade():
             }
         )
 
+    except AdmissionRejected as rejection:
+        record_grade_outcome(grade_context, score, max_score, comment,
+                             "throttled", 429, rejection.reason)
+        return rate_limited_response(rejection)
+
+    except requests.exceptions.RequestException as platform_error:
+        record_grade_outcome(grade_context, score, max_score, comment,
+                             "unavailable", 503, str(platform_error))
+        return platform_unavailable_response(platform_error)
+
     except ValueError as e:
         app.logger.error(f"Grade submission validation error: {str(e)}")
         import traceback
@@ -388,6 +869,7 @@ def submit_grade():
         app.logger.error(f"Error type: {type(e).__name__}")
         import traceback
         app.logger.error(f"Traceback: {traceback.format_exc()}")
+        record_grade_outcome(grade_context, score, max_score, comment, "error", 500, str(e))
         return jsonify({"error": f"Failed to submit grade: {str(e)}"}), 500
 
 
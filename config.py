@@ -4,6 +4,7 @@ Manages all application settings and environment variables
 """
 
 from datetime import timedelta
+import json
 import os
 
 from dotenv import load_dotenv
@@ -42,16 +43,133 @@ class Config:
     SESSION_COOKIE_SAMESITE = "None"  # Required for iframe embedding
     SESSION_COOKIE_DOMAIN = os.environ.get("SESSION_COOKIE_DOMAIN", None)
 
-    # Redis Configuration (if using Redis for sessions)
-    if SESSION_TYPE == "redis":
-        SESSION_REDIS = {
-            "host": os.environ.get("REDIS_HOST", "localhost"),
-            "port": int(os.environ.get("REDIS_PORT", 6379)),
-            "db": int(os.environ.get("REDIS_DB", 0)),
-            "password": os.environ.get("REDIS_PASSWORD", None),
-        }
+    # Redis Configuration (used when SESSION_TYPE or RATE_LIMIT_STORAGE is redis)
+    # Each worker builds one pooled client from these settings; sessions, the
+    # shared cache and rate-limit buckets all borrow connections from it.
+    # A grade submission takes its budget and slot in one call (see README)
+    REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
+    REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+    REDIS_DB = int(os.environ.get("REDIS_DB", 0))
+    REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD", None)
+    REDIS_POOL_SIZE = int(os.environ.get("REDIS_POOL_SIZE", 10))  # connections per worker
+    REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 2))  # wait for a free connection
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 1))  # seconds
+    REDIS_CONNECT_TIMEOUT = float(os.environ.get("REDIS_CONNECT_TIMEOUT", 1))  # seconds
+    # Idle connections are PINGed before reuse once this many seconds have passed
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+    # Grade Token Configuration
+    # Signed token issued at launch so grading works without session lookups
+    GRADE_TOKEN_TTL = int(os.environ.get("GRADE_TOKEN_TTL", 3600))  # seconds
+    # Separate gradebook-only token for instructors, posted (never put in a URL)
+    GRADEBOOK_TOKEN_TTL = int(os.environ.get("GRADEBOOK_TOKEN_TTL", 900))  # seconds
+
+    # Grading Admission Control
+    # Token buckets are shared by all workers through RATE_LIMIT_STORAGE
+    GRADE_RATE_LIMIT_ENABLED = os.environ.get("GRADE_RATE_LIMIT_ENABLED", "True").lower() in ("true", "1", "yes")
+    RATE_LIMIT_STORAGE = os.environ.get(
+        "RATE_LIMIT_STORAGE", "redis" if SESSION_TYPE == "redis" else "sqlite"
+    )  # Options: sqlite, redis
+    RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB",
+                                   "/data/rate_limits.db" if os.path.exists("/data") else "rate_limits.db")
+    GRADE_ISSUER_RATE = float(os.environ.get("GRADE_ISSUER_RATE", 5))  # grades/second per platform
+    GRADE_ISSUER_BURST = float(os.environ.get("GRADE_ISSUER_BURST", 20))
+    GRADE_CLIENT_RATE = float(os.environ.get("GRADE_CLIENT_RATE", 1))  # grades/second per learner
+    GRADE_CLIENT_BURST = float(os.environ.get("GRADE_CLIENT_BURST", 5))
+    # Outbound AGS and key set slots shared by all platforms. Each platform in
+    # lti_config.json keeps its weighted share reserved, even while idle
+    GRADE_TOTAL_CONCURRENCY = int(os.environ.get("GRADE_TOTAL_CONCURRENCY", 3))
+    GRADE_PLATFORM_CONCURRENCY = int(os.environ.get("GRADE_PLATFORM_CONCURRENCY", 2))
+    # Requests allowed to queue for a slot across all workers; the rest get a 429.
+    # Slot holders and queued requests each tie up a sync Gunicorn worker, so keep
+    # GRADE_TOTAL_CONCURRENCY + GRADE_MAX_WAITERS below the worker count to leave
+    # launches a free worker (with -w 4 and 3 slots, nothing may queue)
+    GRADE_MAX_WAITERS = int(os.environ.get("GRADE_MAX_WAITERS", 0))
+    # How long a queued grade or gradebook fetch may wait for a slot before a 429.
+    # Only applies when GRADE_MAX_WAITERS > 0; with no waiters allowed, a request
+    # that finds no free slot is rejected at once
+    GRADE_QUEUE_TIMEOUT = float(os.environ.get("GRADE_QUEUE_TIMEOUT", 5))  # seconds
+
+    # Platform Call Resilience
+    # Every outbound call is bounded by the incoming request's deadline, which
+    # must stay below the Gunicorn worker timeout (30s by default)
+    REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 20))  # seconds
+    PLATFORM_CONNECT_TIMEOUT = float(os.environ.get("PLATFORM_CONNECT_TIMEOUT", 3))
+    PLATFORM_READ_TIMEOUT = float(os.environ.get("PLATFORM_READ_TIMEOUT", 10))
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+    BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", 30))  # seconds
+    # Delay before a hedged second GET (JWKS, lineitems) is sent; 0 disables hedging
+    PLATFORM_HEDGE_DELAY = float(os.environ.get("PLATFORM_HEDGE_DELAY", 0))
+    # How long cached platform keys may be served while the platform is down
+    JWKS_MAX_STALE = int(os.environ.get("JWKS_MAX_STALE", 86400))  # seconds
+
+    # Grade Ledger
+    # Append-only SQLite (WAL) record of every grade submission outcome
+    GRADE_LEDGER_DB = os.environ.get("GRADE_LEDGER_DB",
+                                     "/data/grade_ledger.db" if os.path.exists("/data") else "grade_ledger.db")
+    GRADE_LEDGER_BATCH_SIZE = int(os.environ.get("GRADE_LEDGER_BATCH_SIZE", 50))
+    GRADE_LEDGER_FLUSH_INTERVAL = float(os.environ.get("GRADE_LEDGER_FLUSH_INTERVAL", 1))  # seconds
+    # Bearer token for admin access to /api/grades across all courses
+    LEDGER_ADMIN_TOKEN = os.environ.get("LEDGER_ADMIN_TOKEN", None)
+
+    # Shared Cache
+    # Gradebook data and platform access tokens; Redis when sessions use Redis
+    SHARED_CACHE_DIR = os.environ.get("SHARED_CACHE_DIR", "shared_cache")
+    # Upper bound; each token is also dropped 60s before the platform's expires_in
+    ACCESS_TOKEN_CACHE_TTL = int(os.environ.get("ACCESS_TOKEN_CACHE_TTL", 3000))  # seconds
+
+    # Tenant Isolation
+    # Per-issuer overrides as JSON, e.g.
+    # {"https://courses.example.com": {"weight": 3, "pool_size": 8, "cache_quota": 5000}}
+    TENANT_SETTINGS = json.loads(os.environ.get("TENANT_SETTINGS", "{}"))
+    TENANT_DEFAULT_WEIGHT = int(os.environ.get("TENANT_DEFAULT_WEIGHT", 1))
+    TENANT_POOL_SIZE = int(os.environ.get("TENANT_POOL_SIZE", 4))  # connections per platform host
+    TENANT_CACHE_QUOTA = int(os.environ.get("TENANT_CACHE_QUOTA", 1000))  # cache entries per platform
+
+    # Instructor Gradebook
+    # AGS results are cached per line item and invalidated by our own submissions
+    GRADEBOOK_RESULTS_TTL = int(os.environ.get("GRADEBOOK_RESULTS_TTL", 60))  # seconds
+    GRADEBOOK_ROSTER_TTL = int(os.environ.get("GRADEBOOK_ROSTER_TTL", 300))  # seconds
+
+    # Request Tracing
+    # Head-based sampling: fraction of requests whose spans are exported
+    TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01))
+    TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "file")  # file, none, or module:factory
+    # Each worker writes its own file, with its PID before the extension
+    TRACE_FILE = os.environ.get("TRACE_FILE", "lti_traces.jsonl")
+    # Follow the sampled flag of incoming traceparent headers; enable only when
+    # every request arrives through an upstream that sets or strips the header
+    TRACE_TRUST_UPSTREAM = os.environ.get("TRACE_TRUST_UPSTREAM", "False").lower() in ("true", "1", "yes")
+
+    # OIDC Replay Protection
+    # Issued states and nonces are accepted once, within REPLAY_TTL seconds.
+    # "memory" is per-process and only safe with a single worker.
+    REPLAY_STORE = os.environ.get(
+        "REPLAY_STORE", "redis" if SESSION_TYPE == "redis" else "sqlite"
+    )  # Options: sqlite, redis, memory
+    REPLAY_DB = os.environ.get("REPLAY_DB",
+                               "/data/replay.db" if os.path.exists("/data") else "replay.db")
+    REPLAY_TTL = int(os.environ.get("REPLAY_TTL", 600))  # seconds from login to launch
+    REPLAY_BUCKET_SECONDS = int(os.environ.get("REPLAY_BUCKET_SECONDS", 60))
+    REPLAY_MEMORY_MAX_ENTRIES = int(os.environ.get("REPLAY_MEMORY_MAX_ENTRIES", 200000))
+
+    # Traffic Recording (opt-in)
+    # Appends redacted shapes of /login, /launch and /submit_grade requests for
+    # replay with `python -m utils.traffic_replay`
+    TRAFFIC_RECORD_ENABLED = os.environ.get("TRAFFIC_RECORD_ENABLED", "False").lower() in ("true", "1", "yes")
+    TRAFFIC_RECORD_FILE = os.environ.get("TRAFFIC_RECORD_FILE", "traffic_trace.jsonl")
+    TRAFFIC_RECORD_MAX_BYTES = int(os.environ.get("TRAFFIC_RECORD_MAX_BYTES", 104857600))  # 100MB
+
+    # Health Checks
+    # /readyz serves results of background probes refreshed at this interval
+    HEALTH_PROBE_INTERVAL = float(os.environ.get("HEALTH_PROBE_INTERVAL", 30))  # seconds
 
     # Tool Configuration
+    # Platform registrations; replay runs point this at a generated stub config
+    LTI_CONFIG_FILE = os.environ.get(
+        "LTI_CONFIG_FILE",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "lti_config.json"),
+    )
     TOOL_NAME = os.environ.get("TOOL_NAME", "Minimal LTI 1.3 Tool")
     TOOL_DESCRIPTION = os.environ.get(
         "TOOL_DESCRIPTION", "A minimal LTI 1.3 tool for OpenEdX"
@@ -101,7 +219,7 @@ class Config:
             )
             file_handler.setFormatter(
                 logging.Formatter(
-                    "%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]"
+                    "%(asctime)s %(levelname)s [trace=%(trace_id)s]: %(message)s [in %(pathname)s:%(lineno)d]"
                 )
             )
             file_handler.setLevel(getattr(logging, Config.LOG_LEVEL))
@@ -123,7 +241,13 @@ class ProductionConfig(Config):
 
     DEBUG = False
     SESSION_COOKIE_SECURE = True  # Enforce HTTPS
-    SESSION_TYPE = "redis"  # Use Redis in production
+    SESSION_TYPE = os.environ.get("SESSION_TYPE", "redis")  # Use Redis in production
+    RATE_LIMIT_STORAGE = os.environ.get(
+        "RATE_LIMIT_STORAGE", "redis" if SESSION_TYPE == "redis" else "sqlite"
+    )
+    REPLAY_STORE = os.environ.get(
+        "REPLAY_STORE", "redis" if SESSION_TYPE == "redis" else "sqlite"
+    )
 
     @classmethod
     def init_app(cls, app):
@@ -0,0 +1,39 @@
+"""
+Test Configuration
+Points every on-disk store at a throwaway directory before the app is imported
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_state_dir = tempfile.mkdtemp(prefix="lti-tool-tests-")
+for name, filename in {
+    "SESSION_FILE_DIR": "flask_session",
+    "RATE_LIMIT_DB": "rate_limits.db",
+    "GRADE_LEDGER_DB": "grade_ledger.db",
+    "REPLAY_DB": "replay.db",
+    "SHARED_CACHE_DIR": "shared_cache",
+}.items():
+    os.environ[name] = os.path.join(_state_dir, filename)
+os.environ["SESSION_TYPE"] = "filesystem"
+os.environ["TRACE_EXPORTER"] = "none"
+os.environ["FLASK_SECRET_KEY"] = "test-secret-key"
+
+
+@pytest.fixture(scope="session")
+def lti_app():
+    from app import app
+
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(lti_app):
+    return lti_app.test_client()
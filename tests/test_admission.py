@@ -0,0 +1,256 @@
+"""
+Admission control tests: bucket keys, idle bucket purging, the weighted
+fair share of outbound slots and the combined budget and slot call
+"""
+
+from contextlib import ExitStack
+import sqlite3
+import time
+
+import pytest
+
+from utils.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    QueueFull,
+    RedisBucketStore,
+    SQLiteBucketStore,
+    _fair_grant,
+    get_client_key,
+)
+
+
+def test_client_key_comes_from_token_claims():
+    claims = {"iss": "https://lms.example.com", "aud": "client-id", "sub": "learner-1"}
+    assert get_client_key(claims) == "https://lms.example.com|client-id|learner-1"
+
+
+def test_idle_buckets_are_purged(tmp_path):
+    path = str(tmp_path / "rate_limits.db")
+    store = SQLiteBucketStore(path)
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+            ("client:idle", 0, time.time() - store.BUCKET_IDLE_SECONDS - 1),
+        )
+
+    assert store.take_all([("client:active", 1, 5, None)]) == (None, 0)
+
+    with sqlite3.connect(path) as conn:
+        keys = {row[0] for row in conn.execute("SELECT key FROM buckets")}
+    assert keys == {"client:active"}
+
+
+def test_locked_store_rejects_instead_of_masking_the_error(tmp_path, monkeypatch):
+    path = str(tmp_path / "rate_limits.db")
+    store = SQLiteBucketStore(path)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+
+    connect = sqlite3.connect
+    monkeypatch.setattr(
+        sqlite3,
+        "connect",
+        lambda *args, **kwargs: connect(*args, **dict(kwargs, timeout=0.05)),
+    )
+    try:
+        with pytest.raises(AdmissionRejected, match="busy"):
+            store.take_all([("client:a", 1, 5, None)])
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            store.get_factor("issuer")
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+
+
+def test_fair_share_is_proportional_to_weight():
+    weights = {"a": 3, "b": 1}
+    # 4 slots at 3:1 -> shares of 3 and 1
+    assert _fair_grant("a", 3, 4, 4, {"a": 2}, weights)
+    assert not _fair_grant("a", 3, 4, 4, {"a": 3}, weights)
+    assert _fair_grant("b", 1, 4, 4, {"a": 3}, weights)
+
+
+def test_share_is_at_least_one_slot():
+    assert _fair_grant("b", 1, 4, 4, {"a": 3}, {"a": 100, "b": 1})
+
+
+def test_idle_tenants_keep_their_share_reserved():
+    weights = {"a": 1, "b": 1}
+    # a is at its share of 2 and b holds nothing: b's 2 slots stay free for b
+    assert not _fair_grant("a", 1, 4, 4, {"a": 2}, weights)
+    # b uses one of its 2 slots; the other is still reserved
+    assert not _fair_grant("a", 1, 4, 4, {"a": 2, "b": 1}, weights)
+
+
+def test_borrowing_uses_only_unreserved_slots():
+    weights = {"a": 1, "b": 1}
+    # 5 slots -> shares of 2 each, and one slot left over for either to borrow
+    assert _fair_grant("a", 1, 4, 5, {"a": 2}, weights)
+    assert not _fair_grant("a", 1, 4, 5, {"a": 3}, weights)
+    assert _fair_grant("b", 1, 4, 5, {"a": 3}, weights)
+    # Once b holds its share, nothing more is reserved for it
+    assert _fair_grant("a", 1, 4, 5, {"a": 2, "b": 2}, weights)
+
+
+def test_tenant_and_total_limits_are_hard_caps():
+    assert not _fair_grant("a", 1, 1, 4, {"a": 1}, {"a": 1})
+    assert not _fair_grant("b", 1, 4, 2, {"a": 2}, {"a": 1})
+
+
+def _controller(store, tenant_weights=None, **kwargs):
+    settings = {
+        "issuer_rate": 10,
+        "issuer_burst": 10,
+        "client_rate": 10,
+        "client_burst": 10,
+        "platform_concurrency": 2,
+        "total_concurrency": 3,
+        **kwargs,
+    }
+    weight_for = (tenant_weights or {}).get
+    return AdmissionController(
+        store,
+        weight_for=lambda issuer: weight_for(issuer, 1),
+        tenant_weights=tenant_weights,
+        **settings,
+    )
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def slot_store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteBucketStore(str(tmp_path / "rate_limits.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RedisBucketStore(fakeredis.FakeRedis())
+
+
+def test_burst_cannot_take_a_heavier_tenants_share(slot_store):
+    store = slot_store
+    controller = _controller(store, {"light": 1, "heavy": 10})
+
+    with ExitStack() as stack:
+        stack.enter_context(controller.outbound_slot("light"))
+        with pytest.raises(AdmissionRejected):
+            stack.enter_context(controller.outbound_slot("light"))
+        stack.enter_context(controller.outbound_slot("heavy"))
+        stack.enter_context(controller.outbound_slot("heavy"))
+        assert store.slot_usage() == {
+            "light": {"held": 1, "queued": 0},
+            "heavy": {"held": 2, "queued": 0},
+        }
+
+
+def _acquire(store, tenant, waiter_id, max_waiters):
+    return store.acquire_slot(tenant, 1, 2, 1, 30, waiter_id, 2, max_waiters, {})
+
+
+def test_waiters_are_capped_across_workers(tmp_path):
+    store = SQLiteBucketStore(str(tmp_path / "rate_limits.db"))
+    assert _acquire(store, "a", "w0", 1) is not None
+
+    assert _acquire(store, "b", "w1", 1) is None
+    with pytest.raises(AdmissionRejected, match="queue is full"):
+        _acquire(store, "b", "w2", 1)
+    # An already queued request keeps its place when it polls again
+    assert _acquire(store, "b", "w1", 1) is None
+    assert store.slot_usage() == {
+        "a": {"held": 1, "queued": 0},
+        "b": {"held": 0, "queued": 1},
+    }
+
+
+def test_no_queueing_rejects_at_once(slot_store):
+    store = slot_store
+    controller = _controller(store, total_concurrency=1, queue_timeout=5)
+
+    with controller.outbound_slot("a"):
+        started = time.monotonic()
+        rejected = pytest.raises(AdmissionRejected, match="concurrent")
+        with rejected, controller.outbound_slot("b"):
+            pass
+        assert time.monotonic() - started < 1
+    assert store.slot_usage() == {}
+
+
+def test_background_calls_never_queue_or_raise(slot_store):
+    store = slot_store
+    controller = _controller(store, total_concurrency=1, max_waiters=5)
+
+    with controller.outbound_slot("a"), controller.background_slot("a", "jwks") as slot:
+        assert slot is None
+        assert store.slot_usage() == {"a": {"held": 1, "queued": 0}}
+    with controller.background_slot("a", "jwks") as slot:
+        assert slot is not None
+    assert store.slot_usage() == {}
+
+
+def test_budget_charge_and_slot_share_one_store_call(slot_store):
+    buckets = [("client:c", 1, 1, None), ("issuer:a", 1, 5, "a")]
+
+    rejected, _, lease = slot_store.take_all_and_acquire_slot(
+        buckets, "a", 1, 1, 1, 30, "w0", 2, 0, {}
+    )
+    assert rejected is None and lease is not None
+    # The client's bucket is empty: no slot is taken
+    rejected, retry_after, lease = slot_store.take_all_and_acquire_slot(
+        buckets, "b", 1, 1, 1, 30, "w1", 2, 0, {}
+    )
+    assert (rejected, lease) == (0, None)
+    assert retry_after > 0
+    assert slot_store.slot_usage() == {"a": {"held": 1, "queued": 0}}
+
+
+def test_full_queue_charges_no_budget(slot_store):
+    buckets = [("client:c", 1, 1, None)]
+    assert _acquire(slot_store, "a", "w0", 0) is not None
+
+    with pytest.raises(QueueFull):
+        slot_store.take_all_and_acquire_slot(buckets, "b", 1, 2, 1, 30, "w1", 2, 0, {})
+    assert slot_store.take_all(buckets) == (None, 0)
+
+
+def test_outbound_slot_charges_the_client_budget(slot_store):
+    controller = _controller(slot_store, client_burst=1)
+
+    with controller.outbound_slot("a", client_key="learner"):
+        pass
+    rejected = pytest.raises(AdmissionRejected, match="Too many grade submissions")
+    with rejected, controller.outbound_slot("a", client_key="learner"):
+        pass
+    assert slot_store.slot_usage() == {}
+
+
+def test_submit_without_permission_charges_no_budget(client, monkeypatch):
+    import app as app_module
+    from utils.grade_token import AGS_CLAIM, GRADE_USE, issue_grade_token
+
+    class _Launch:
+        def get_launch_data(self):
+            return {
+                "iss": "https://lms.example.com",
+                "aud": "client-id",
+                AGS_CLAIM: {"scope": [], "lineitem": "https://lms.example.com/li/1"},
+            }
+
+    class _ReadOnlyAgs:
+        def can_put_grade(self):
+            return False
+
+    charged = []
+    monkeypatch.setattr(app_module, "ToolConfJsonFile", lambda _path: None)
+    monkeypatch.setattr(
+        app_module, "get_ags_from_grade_token", lambda *_args: _ReadOnlyAgs()
+    )
+    for name in ("take_all", "take_all_and_acquire_slot"):
+        monkeypatch.setattr(
+            app_module.admission.store, name, lambda *args: charged.append(args)
+        )
+    token = issue_grade_token(
+        "test-secret-key", _Launch(), "learner-1", "course-v1:X+Y+Z", 60, use=GRADE_USE
+    )
+
+    response = client.post("/submit_grade", json={"score": 1, "grade_token": token})
+    assert response.status_code == 403
+    assert charged == []
@@ -0,0 +1,148 @@
+"""
+Grade ledger tests: rows the database rejects never block other rows, and
+exports are safe to open in a spreadsheet
+"""
+
+import csv
+import io
+import sqlite3
+
+from utils.grade_ledger import COLUMNS, GradeLedger
+
+
+def _ledger(tmp_path):
+    return GradeLedger(str(tmp_path / "grade_ledger.db"), batch_size=10)
+
+
+def _rows(ledger):
+    return ledger.query(limit=100)[0]
+
+
+def test_record_coerces_client_values(tmp_path):
+    ledger = _ledger(tmp_path)
+    ledger.record(
+        user_id=42,
+        comment={"nested": "object"},
+        score="7.5",
+        max_score="not a number",
+        outcome="submitted",
+        status_code="200",
+    )
+    ledger.flush()
+
+    (row,) = _rows(ledger)
+    assert row["user_id"] == "42"
+    assert row["comment"] == "{'nested': 'object'}"
+    assert row["score"] == 7.5
+    assert row["max_score"] is None
+    assert row["status_code"] == 200
+
+
+def test_rejected_row_is_dropped_without_losing_the_batch(tmp_path):
+    ledger = _ledger(tmp_path)
+    good = (
+        "2026-01-01T00:00:00.000000Z",
+        "iss",
+        "course",
+        "learner",
+        1.0,
+        1.0,
+        "",
+        "submitted",
+        200,
+        None,
+        None,
+    )
+    bad = good[:2] + ({"not": "bindable"},) + good[3:]
+    missing_outcome = good[:7] + (None,) + good[8:]
+
+    assert ledger._write([good, bad, missing_outcome, good]) == []
+    assert [row["user_id"] for row in _rows(ledger)] == ["learner", "learner"]
+
+
+def test_locked_database_keeps_rows_for_retry(tmp_path, monkeypatch):
+    ledger = _ledger(tmp_path)
+
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(ledger, "_connect", locked)
+    row = ("2026-01-01T00:00:00.000000Z",) + (None,) * 6 + ("submitted",) + (None,) * 3
+    assert ledger._write([row]) == [row]
+
+
+def test_submit_rejects_non_string_comment(client):
+    response = client.post("/submit_grade", json={"score": 1, "comment": {"a": 1}})
+    assert response.status_code == 400
+    response = client.post("/submit_grade", json={"score": 1, "user_id": ["x"]})
+    assert response.status_code == 400
+
+
+def test_csv_export_neutralises_formulas(tmp_path):
+    ledger = _ledger(tmp_path)
+    for comment in (
+        '=HYPERLINK("http://x")',
+        "+1",
+        "-2",
+        "@SUM(A1)",
+        "\tx",
+        "\rx",
+        "fine",
+    ):
+        ledger.record(
+            user_id="learner", comment=comment, score=-1.0, outcome="submitted"
+        )
+    ledger.flush()
+
+    rows = list(csv.reader(io.StringIO("".join(ledger.iter_csv()))))
+    comments = [row[COLUMNS.index("comment")] for row in rows[1:]]
+    assert comments == [
+        '\'=HYPERLINK("http://x")',
+        "'+1",
+        "'-2",
+        "'@SUM(A1)",
+        "'\tx",
+        "'\rx",
+        "fine",
+    ]
+    assert rows[1][COLUMNS.index("score")] == "-1.0"
+
+
+def test_late_committed_rows_are_not_skipped_by_pagination(tmp_path):
+    ledger = _ledger(tmp_path)
+    for user_id, second in (("b", 2), ("c", 3)):
+        ledger.record(
+            recorded_at=f"2026-01-01T00:00:0{second}.000000Z",
+            user_id=user_id,
+            outcome="submitted",
+        )
+    ledger.flush()
+    page, cursor = ledger.query(limit=1)
+    assert [row["user_id"] for row in page] == ["b"]
+
+    # Queued before b but committed after the client paged past it
+    ledger.record(
+        recorded_at="2026-01-01T00:00:01.000000Z", user_id="a", outcome="submitted"
+    )
+    ledger.flush()
+    page, _ = ledger.query(after=cursor, limit=10)
+    assert [row["user_id"] for row in page] == ["c", "a"]
+
+
+def test_pagination_queries_use_an_index(tmp_path):
+    ledger = _ledger(tmp_path)
+    with sqlite3.connect(ledger.path) as conn:
+        for where in (
+            "course_id = 'c'",
+            "course_id = 'c' AND user_id = 'u'",
+            "user_id = 'u'",
+        ):
+            plan = " ".join(
+                row[-1]
+                for row in conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT * FROM grade_ledger "
+                    f"WHERE {where} AND id > 5 ORDER BY id"
+                )
+            )
+            assert "USING INDEX" in plan
+            assert "TEMP B-TREE" not in plan
@@ -0,0 +1,173 @@
+"""
+Grade token tests: only untampered, unexpired tokens issued for grading may
+submit a grade, and only for their own subject
+"""
+
+import logging
+import time
+
+import pytest
+
+from utils.grade_token import (
+    AGS_CLAIM,
+    GRADE_USE,
+    GRADEBOOK_USE,
+    GradeTokenError,
+    issue_grade_token,
+    verify_grade_token,
+)
+from utils.health import unwrap_session_interface
+
+SECRET = "test-secret-key"
+ISSUER = "https://edx.hurixsystems.com"
+
+
+class _Launch:
+    """Stands in for a validated MessageLaunch; only launch data is read"""
+
+    def get_launch_data(self):
+        return {
+            "iss": ISSUER,
+            "aud": "client-id",
+            "sub": "learner-1",
+            AGS_CLAIM: {
+                "scope": ["https://purl.imsglobal.org/spec/lti-ags/scope/score"],
+                "lineitem": f"{ISSUER}/lineitems/1",
+            },
+        }
+
+
+def _token(ttl=60, use=GRADE_USE):
+    return issue_grade_token(
+        SECRET,
+        _Launch(),
+        "learner-1",
+        "course-v1:X+Y+Z",
+        ttl,
+        is_instructor=True,
+        use=use,
+    )
+
+
+def test_valid_token_round_trips():
+    claims = verify_grade_token(SECRET, _token())
+    assert claims["sub"] == "learner-1"
+    assert claims["iss"] == ISSUER
+
+
+def test_tampered_token_is_rejected():
+    payload, signature = _token().split(".")
+    forged = payload[:-2] + ("AA" if payload[-2:] != "AA" else "BB")
+    with pytest.raises(GradeTokenError):
+        verify_grade_token(SECRET, f"{forged}.{signature}")
+    with pytest.raises(GradeTokenError):
+        verify_grade_token("other-secret", _token())
+
+
+def test_expired_token_is_rejected():
+    token = _token(ttl=-1)
+    time.sleep(0.01)
+    with pytest.raises(GradeTokenError, match="expired"):
+        verify_grade_token(SECRET, token)
+
+
+@pytest.mark.parametrize("token", [None, "", "no-dot", "a.b.c"])
+def test_malformed_token_is_rejected(token):
+    with pytest.raises(GradeTokenError):
+        verify_grade_token(SECRET, token)
+
+
+def test_submit_without_token_is_rejected(client):
+    response = client.post(
+        "/submit_grade",
+        json={"score": 100, "launch_id": "lti1p3-launch-x", "user_id": "victim-user"},
+    )
+    assert response.status_code == 401
+
+
+def test_submit_with_tampered_token_is_rejected(client):
+    payload, signature = _token().split(".")
+    response = client.post(
+        "/submit_grade",
+        json={"score": 100, "grade_token": f"{payload}x.{signature}"},
+    )
+    assert response.status_code == 401
+
+
+def test_submit_with_expired_token_is_rejected(client):
+    response = client.post(
+        "/submit_grade", json={"score": 100, "grade_token": _token(ttl=-1)}
+    )
+    assert response.status_code == 401
+
+
+def test_submit_for_another_user_is_rejected(client):
+    response = client.post(
+        "/submit_grade",
+        json={"score": 100, "grade_token": _token(), "user_id": "victim-user"},
+    )
+    assert response.status_code == 403
+
+
+def test_token_is_only_valid_for_its_use():
+    with pytest.raises(GradeTokenError, match="not valid"):
+        verify_grade_token(SECRET, _token(use=GRADEBOOK_USE))
+    with pytest.raises(GradeTokenError, match="not valid"):
+        verify_grade_token(SECRET, _token(), use=GRADEBOOK_USE)
+
+
+def test_submit_with_gradebook_token_is_rejected(client):
+    response = client.post(
+        "/submit_grade", json={"score": 100, "grade_token": _token(use=GRADEBOOK_USE)}
+    )
+    assert response.status_code == 401
+
+
+def test_gradebook_rejects_grade_token_and_url_tokens(client):
+    response = client.post("/instructor/gradebook", data={"token": _token()})
+    assert response.status_code == 401
+    response = client.get(f"/instructor/gradebook?token={_token(use=GRADEBOOK_USE)}")
+    assert response.status_code == 405
+
+
+def test_gradebook_for_unregistered_issuer_is_rejected(client, monkeypatch):
+    import app as app_module
+
+    class _NoRegistrations:
+        def check_iss_has_many_clients(self, _iss):
+            return False
+
+        def find_registration_by_issuer(self, _iss):
+            return None
+
+    monkeypatch.setattr(
+        app_module, "ToolConfJsonFile", lambda _path: _NoRegistrations()
+    )
+    response = client.post(
+        "/instructor/gradebook", data={"token": _token(use=GRADEBOOK_USE)}
+    )
+    assert response.status_code == 401
+    assert "No registration found" in response.get_json()["error"]
+
+
+def test_grade_token_is_never_logged(client, lti_app, caplog):
+    token = _token(ttl=-1)
+    with caplog.at_level(logging.INFO, logger=lti_app.logger.name):
+        client.post("/submit_grade", json={"score": 100, "grade_token": token})
+    assert caplog.records
+    assert token not in caplog.text
+
+
+def test_submit_does_no_session_io(client, lti_app, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("session store touched")
+
+    store = unwrap_session_interface(lti_app.session_interface)
+    monkeypatch.setattr(store, "open_session", fail)
+    monkeypatch.setattr(store, "save_session", fail)
+    client.set_cookie(lti_app.config["SESSION_COOKIE_NAME"], "some-session-id")
+
+    response = client.post(
+        "/submit_grade", json={"score": 100, "grade_token": _token(ttl=-1)}
+    )
+    assert response.status_code == 401
@@ -0,0 +1,33 @@
+"""
+Readiness tests: /readyz answers from background probes and never probes inline
+"""
+
+import json
+import threading
+import time
+
+from utils.health import HealthMonitor
+
+
+def test_snapshot_reports_starting_until_first_probe_finishes():
+    release = threading.Event()
+
+    def slow_check():
+        release.wait(5)
+        return {"backend": "test"}
+
+    monitor = HealthMonitor({"slow": slow_check}, interval=60, critical=("slow",))
+
+    started = time.monotonic()
+    body, status_code = monitor.snapshot()
+    assert time.monotonic() - started < 1
+    assert status_code == 503
+    assert json.loads(body) == {"status": "starting"}
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while monitor.snapshot()[1] != 200 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    body, status_code = monitor.snapshot()
+    assert status_code == 200
+    assert json.loads(body)["checks"]["slow"]["status"] == "ok"
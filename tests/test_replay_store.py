@@ -0,0 +1,104 @@
+"""
+Replay store tests: states and nonces are consumed once, expire after the
+TTL, and the in-memory store stays within its size cap
+"""
+
+import pytest
+
+from utils import replay_store
+from utils.replay_store import (
+    MemoryReplayStore,
+    RedisReplayStore,
+    ReplayStoreSessionService,
+    SQLiteReplayStore,
+)
+
+TTL = 600
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(replay_store.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryReplayStore(ttl=TTL, bucket_seconds=60)
+    if request.param == "sqlite":
+        return SQLiteReplayStore(
+            str(tmp_path / "replay.db"), ttl=TTL, bucket_seconds=60
+        )
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisReplayStore(fakeredis.FakeRedis(), ttl=TTL)
+
+
+def test_state_and_nonce_are_consumed_once(store):
+    service = ReplayStoreSessionService(None, store)
+    service.save_state("state-1")
+    service.save_nonce("nonce-1")
+
+    assert service.consume_state("state-1")
+    assert not service.consume_state("state-1")
+    assert service.check_nonce("nonce-1")
+    assert not service.check_nonce("nonce-1")
+
+
+def test_unknown_values_are_rejected(store):
+    service = ReplayStoreSessionService(None, store)
+    service.save_state("state-1")
+
+    assert not service.consume_state("state-2")
+    assert not service.check_nonce("state-1")
+    assert not service.check_state_is_valid("state-1", "hash")
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_values_expire_after_the_ttl(backend, clock, tmp_path):
+    if backend == "memory":
+        store = MemoryReplayStore(ttl=TTL, bucket_seconds=60)
+    else:
+        store = SQLiteReplayStore(
+            str(tmp_path / "replay.db"), ttl=TTL, bucket_seconds=60
+        )
+    store.add("state:fresh")
+    store.add("state:stale")
+
+    clock.now += TTL - 60
+    assert store.consume("state:fresh")
+    clock.now += 120
+    assert not store.consume("state:stale")
+
+
+def test_redis_values_expire_after_the_ttl():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    store = RedisReplayStore(client, ttl=TTL)
+    store.add("state:fresh")
+
+    assert 0 < client.ttl(store.prefix + "state:fresh") <= TTL
+
+
+def test_memory_store_evicts_oldest_bucket_when_full(clock):
+    store = MemoryReplayStore(ttl=TTL, bucket_seconds=60, max_entries=3)
+    store.add("state:a")
+    store.add("state:b")
+    clock.now += 60
+    store.add("state:c")
+    clock.now += 60
+    store.add("state:d")
+
+    assert not store.consume("state:a")
+    assert not store.consume("state:b")
+    assert store.consume("state:c")
+    assert store.consume("state:d")
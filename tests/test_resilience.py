@@ -0,0 +1,218 @@
+"""
+Platform call resilience tests: circuit breakers, request deadlines, stale
+key sets, hedged GETs, and key set fetches sharing the tenant slots
+"""
+
+import json
+import threading
+import time
+
+from pylti1p3.exception import LtiException
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from utils.admission import AdmissionController, SQLiteBucketStore
+from utils.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    PlatformSession,
+    clear_deadline,
+    set_deadline,
+)
+
+ISSUER = "https://lms.example.com"
+JWKS_URL = f"{ISSUER}/api/lti/1.3/jwks/"
+
+
+class ScriptedAdapter(BaseAdapter):
+    """
+    Answers each request with the next queued status or exception; a
+    (seconds, status) outcome answers after a delay
+    """
+
+    def __init__(self, outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.timeouts = []
+        self._lock = threading.Lock()
+
+    def send(self, request, timeout=None, **_kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            outcome = self.outcomes.pop(0)
+            self.timeouts.append(timeout)
+        if isinstance(outcome, tuple):
+            delay, outcome = outcome
+            time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response._content = json.dumps({"keys": [], "call": call}).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def _session(adapter, **kwargs):
+    session = PlatformSession(**kwargs)
+    session.allow_stale(JWKS_URL)
+    session.isolate_host("lms.example.com", ISSUER, 2)
+    session.mount(f"{ISSUER}/", adapter)
+    return session
+
+
+def test_key_set_fetch_reuses_last_key_set_when_no_slot_is_free(tmp_path):
+    controller = AdmissionController(
+        SQLiteBucketStore(str(tmp_path / "rate_limits.db")),
+        issuer_rate=10,
+        issuer_burst=10,
+        client_rate=10,
+        client_burst=10,
+        platform_concurrency=1,
+        total_concurrency=1,
+    )
+    adapter = ScriptedAdapter([200, 200])
+    session = _session(adapter, slot_for=controller.background_slot)
+
+    assert session.get(JWKS_URL).json()["call"] == 1
+    with controller.outbound_slot(ISSUER):
+        assert session.get(JWKS_URL).json()["call"] == 1
+    assert adapter.calls == 1
+    assert session.get(JWKS_URL).json()["call"] == 2
+
+
+def test_breaker_opens_after_consecutive_failures_then_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+
+
+def test_open_circuit_fails_fast_without_calling_the_platform():
+    adapter = ScriptedAdapter([500, requests.exceptions.ConnectionError(), 200])
+    session = _session(adapter, failure_threshold=2, reset_timeout=0.05)
+    url = f"{ISSUER}/api/lti/ags/lineitems/1"
+
+    assert session.get(url).status_code == 500
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get(url)
+    with pytest.raises(CircuitOpenError):
+        session.get(url)
+    assert adapter.calls == 2
+
+    time.sleep(0.06)
+    assert session.get(url).status_code == 200
+    assert session.breaker_states()["lms.example.com"]["state"] == "closed"
+
+
+def test_deadline_bounds_the_call_timeout():
+    adapter = ScriptedAdapter([200])
+    session = _session(adapter, connect_timeout=3.0, read_timeout=10.0)
+    set_deadline(0.5)
+    try:
+        session.get(f"{ISSUER}/api/lti/ags/lineitems/1")
+    finally:
+        clear_deadline()
+    connect, read = adapter.timeouts[0]
+    assert 0 < connect <= 0.5
+    assert 0 < read <= 0.5
+
+
+def test_spent_deadline_skips_the_call():
+    adapter = ScriptedAdapter([200])
+    session = _session(adapter)
+    set_deadline(-1)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            session.get(f"{ISSUER}/api/lti/ags/lineitems/1")
+    finally:
+        clear_deadline()
+    assert adapter.calls == 0
+
+
+def test_failing_key_set_host_serves_the_last_key_set():
+    adapter = ScriptedAdapter([200, requests.exceptions.ConnectionError(), 503])
+    session = _session(adapter)
+
+    assert session.get(JWKS_URL).json()["call"] == 1
+    assert session.get(JWKS_URL).json()["call"] == 1
+    assert session.get(JWKS_URL).json()["call"] == 1
+    assert adapter.calls == 3
+
+
+def test_stale_key_set_expires_after_max_stale():
+    adapter = ScriptedAdapter([200, requests.exceptions.ConnectionError()])
+    session = _session(adapter, max_stale=0)
+
+    session.get(JWKS_URL)
+    time.sleep(0.01)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get(JWKS_URL)
+
+
+def test_slow_get_is_hedged_with_a_second_attempt():
+    adapter = ScriptedAdapter([(0.5, 200), 200])
+    session = _session(adapter, hedge_delay=0.05)
+
+    started = time.monotonic()
+    assert session.get(JWKS_URL).json()["call"] == 2
+    assert time.monotonic() - started < 0.4
+    assert adapter.calls == 2
+
+
+def test_fast_get_is_not_hedged():
+    adapter = ScriptedAdapter([200])
+    session = _session(adapter, hedge_delay=0.5)
+
+    assert session.get(JWKS_URL).json()["call"] == 1
+    assert adapter.calls == 1
+
+
+def test_unreachable_key_set_fails_the_launch_with_503(client, monkeypatch):
+    import app as app_module
+
+    def unreachable(*_args, **_kwargs):
+        try:
+            raise requests.exceptions.ConnectionError("connection refused")
+        except requests.exceptions.RequestException as e:
+            raise LtiException(f"Error during fetch URL {JWKS_URL}: {e}") from e
+
+    monkeypatch.setattr(app_module, "ToolConfJsonFile", lambda _path: None)
+    monkeypatch.setattr(app_module, "TracedFlaskMessageLaunch", unreachable)
+    response = client.post("/launch", data={"id_token": "x", "state": "y"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+
+def test_invalid_launch_is_still_400(client, monkeypatch):
+    import app as app_module
+
+    def invalid(*_args, **_kwargs):
+        raise LtiException("State not found")
+
+    monkeypatch.setattr(app_module, "ToolConfJsonFile", lambda _path: None)
+    monkeypatch.setattr(app_module, "TracedFlaskMessageLaunch", invalid)
+    assert client.post("/launch", data={"state": "y"}).status_code == 400
@@ -0,0 +1,101 @@
+"""
+Shared access token tests: cached tokens respect the platform's expires_in
+and are evicted when the platform rejects them
+"""
+
+import json
+
+from cachelib import SimpleCache
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from pylti1p3.registration import Registration
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from utils.lti_utils import SharedTokenServiceConnector
+
+TOKEN_URL = "https://lms.example.com/oauth2/access_token"
+SERVICE_URL = "https://lms.example.com/api/lti/lineitems/1/results"
+
+
+class CannedAdapter(BaseAdapter):
+    """Answers token and service requests from queued (status, body) pairs"""
+
+    def __init__(self, token_responses, service_responses):
+        super().__init__()
+        self.token_responses = list(token_responses)
+        self.service_responses = list(service_responses)
+        self.service_tokens = []
+
+    def send(self, request, **_kwargs):
+        if request.url == TOKEN_URL:
+            status, body = self.token_responses.pop(0)
+        else:
+            self.service_tokens.append(request.headers["Authorization"])
+            status, body = self.service_responses.pop(0)
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode("utf-8")
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def registration():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode("ascii")
+    return (
+        Registration()
+        .set_issuer("https://lms.example.com")
+        .set_client_id("client-id")
+        .set_auth_token_url(TOKEN_URL)
+        .set_tool_private_key(pem)
+    )
+
+
+def _connector(registration, adapter, cache, token_ttl=3000):
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return SharedTokenServiceConnector(registration, session, cache, token_ttl)
+
+
+class RecordingCache(SimpleCache):
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def set(self, key, value, timeout=None):
+        self.timeouts.append(timeout)
+        return super().set(key, value, timeout)
+
+
+def test_cache_ttl_is_capped_by_expires_in(registration):
+    cache = RecordingCache()
+    adapter = CannedAdapter([(200, {"access_token": "short", "expires_in": 300})], [])
+
+    assert (
+        _connector(registration, adapter, cache).get_access_token(["scope"]) == "short"
+    )
+    assert cache.timeouts == [300 - SharedTokenServiceConnector.EXPIRY_MARGIN]
+
+
+def test_unauthorized_response_evicts_cached_token(registration):
+    cache = SimpleCache()
+    adapter = CannedAdapter(
+        [(200, {"access_token": "revoked"}), (200, {"access_token": "fresh"})],
+        [(401, {"error": "invalid_token"}), (200, [])],
+    )
+    connector = _connector(registration, adapter, cache)
+
+    assert connector.make_service_request(["scope"], SERVICE_URL)["body"] == []
+    assert adapter.service_tokens == ["Bearer revoked", "Bearer fresh"]
+    assert cache.get(connector._token_key(["scope"])) == "fresh"
@@ -0,0 +1,78 @@
+"""
+Tenant cache tests: each issuer gets its own partition, and quota-bounded
+Redis partitions evict the entries closest to expiry
+"""
+
+from datetime import timedelta
+
+import pytest
+import redis
+
+from utils.tenancy import QuotaRedisCache, TenantCaches, TenantRegistry
+
+LMS_A = "https://a.example.com"
+LMS_B = "https://b.example.com"
+
+
+@pytest.fixture
+def fake_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis()
+
+
+def test_counters_are_blocked():
+    # No connection is opened until a command runs
+    cache = QuotaRedisCache(redis.Redis(), "lti:cache:test:", quota=10)
+    with pytest.raises(NotImplementedError):
+        cache.inc("hits")
+    with pytest.raises(NotImplementedError):
+        cache.dec("hits")
+
+
+def test_quota_evicts_entries_closest_to_expiry(fake_redis):
+    cache = QuotaRedisCache(fake_redis, "lti:cache:t:", quota=2)
+    cache.set("forever", 1, timeout=0)
+    cache.set("soon", 2, timeout=60)
+    cache.set("later", 3, timedelta(minutes=5))
+
+    assert cache.get("soon") is None
+    assert cache.get("forever") == 1
+    assert cache.get("later") == 3
+    assert fake_redis.zcard("lti:cache:t:__index__") == 2
+
+
+def test_add_and_delete_keep_the_index_in_step(fake_redis):
+    cache = QuotaRedisCache(fake_redis, "lti:cache:t:", quota=2)
+    assert cache.add("a", 1)
+    assert not cache.add("a", 2)
+    assert cache.get("a") == 1
+
+    cache.set("b", 2)
+    cache.delete_many("a", "b")
+    assert fake_redis.zcard("lti:cache:t:__index__") == 0
+
+    # Deleted keys no longer count against the quota
+    cache.set("c", 3)
+    cache.set("d", 4)
+    assert (cache.get("c"), cache.get("d")) == (3, 4)
+
+
+def test_redis_partitions_are_isolated(fake_redis):
+    registry = TenantRegistry({LMS_A: {"cache_quota": 1}}, default_cache_quota=5)
+    caches = TenantCaches(registry, redis_client=fake_redis)
+    caches.for_issuer(LMS_B).set("token", "b")
+    caches.for_issuer(LMS_A).set("token", "a")
+    caches.for_issuer(LMS_A).set("other", "a2")
+
+    assert caches.for_issuer(LMS_A).get("token") is None
+    assert caches.for_issuer(LMS_B).get("token") == "b"
+
+
+def test_filesystem_partitions_are_isolated(tmp_path):
+    caches = TenantCaches(TenantRegistry(), cache_dir=str(tmp_path))
+    caches.for_issuer(LMS_A).set("token", "a")
+
+    assert caches.for_issuer(LMS_B).get("token") is None
+    assert caches.for_issuer(LMS_A).get("token") == "a"
+    assert caches.for_issuer(LMS_A) is caches.for_issuer(LMS_A)
@@ -0,0 +1,42 @@
+"""
+Tracing tests: callers cannot force head sampling through traceparent, and
+each worker process exports to its own trace file
+"""
+
+import json
+import os
+
+from utils import tracing
+from utils.tracing import RotatingFileExporter, Tracer
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SAMPLED = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+def test_untrusted_traceparent_keeps_trace_id_but_not_sampling():
+    tracer = Tracer(exporter=lambda _spans: None, sample_rate=0.0)
+    trace = tracer.start_trace(SAMPLED)
+    tracer.end_trace()
+    assert trace.trace_id == TRACE_ID
+    assert not trace.sampled
+
+
+def test_trusted_upstream_sampling_is_followed():
+    tracer = Tracer(exporter=lambda _spans: None, sample_rate=0.0, trust_upstream=True)
+    trace = tracer.start_trace(SAMPLED)
+    tracer.end_trace()
+    assert trace.sampled
+
+
+def test_each_process_writes_its_own_trace_file(tmp_path, monkeypatch):
+    parent_pid = os.getpid()
+    exporter = RotatingFileExporter(str(tmp_path / "lti_traces.jsonl"))
+    exporter([{"id": "parent"}])
+    monkeypatch.setattr(tracing.os, "getpid", lambda: 4242)
+    exporter([{"id": "child"}])
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        [f"lti_traces.{parent_pid}.jsonl", "lti_traces.4242.jsonl"]
+    )
+    child = tmp_path / "lti_traces.4242.jsonl"
+    assert json.loads(child.read_text()) == {"id": "child"}
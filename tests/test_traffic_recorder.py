@@ -0,0 +1,102 @@
+"""
+Traffic recorder tests: traces keep no tokens or personal data, and hashed
+identifiers link a user's requests within a trace
+"""
+
+import json
+from urllib.parse import urlencode
+
+import jwt
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from utils.grade_token import AGS_CLAIM, issue_grade_token
+from utils.traffic_recorder import LTI_CLAIM, TrafficRecorder
+
+ISSUER = "https://lms.example.com"
+SUB = "a3f1c2e4-learner-sub"
+EMAIL = "ada.lovelace@example.com"
+NAME = "Ada Lovelace"
+
+
+class _Launch:
+    def get_launch_data(self):
+        return {
+            "iss": ISSUER,
+            "aud": "client-id",
+            AGS_CLAIM: {"scope": [], "lineitem": f"{ISSUER}/lineitems/1"},
+        }
+
+
+def _app(environ, start_response):
+    return Response("ok")(environ, start_response)
+
+
+def _record(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    client = Client(TrafficRecorder(_app, str(path), "test-secret-key"))
+    id_token = jwt.encode(
+        {
+            "iss": ISSUER,
+            "sub": SUB,
+            "email": EMAIL,
+            "name": NAME,
+            "given_name": "Ada",
+            LTI_CLAIM + "context": {"id": "course-v1:X+Y+Z"},
+            LTI_CLAIM + "roles": [],
+        },
+        "platform-key",
+        algorithm="HS256",
+    )
+    grade_token = issue_grade_token(
+        "test-secret-key", _Launch(), SUB, "course-v1:X+Y+Z", 60
+    )
+
+    client.get("/login?" + urlencode({"iss": ISSUER, "login_hint": SUB}), buffered=True)
+    client.post(
+        "/launch",
+        data=urlencode({"id_token": id_token, "state": "state-1"}),
+        content_type="application/x-www-form-urlencoded",
+        buffered=True,
+    )
+    client.post(
+        "/submit_grade",
+        data=json.dumps({"score": 80, "grade_token": grade_token, "comment": NAME}),
+        content_type="application/json",
+        buffered=True,
+    )
+    trace = path.read_text(encoding="utf-8")
+    return (
+        trace,
+        [json.loads(line) for line in trace.splitlines()],
+        id_token,
+        grade_token,
+    )
+
+
+def test_trace_keeps_no_tokens_or_personal_data(tmp_path):
+    trace, records, id_token, grade_token = _record(tmp_path)
+
+    assert [record["p"] for record in records] == ["login", "launch", "submit"]
+    for secret in (
+        id_token,
+        grade_token,
+        *id_token.split("."),
+        *grade_token.split("."),
+        SUB,
+        EMAIL,
+        NAME,
+        "Ada",
+        "course-v1:X+Y+Z",
+        "state-1",
+        "test-secret-key",
+    ):
+        assert secret not in trace
+
+
+def test_hashed_ids_are_stable_within_a_trace(tmp_path):
+    _, (login, launch, submit), _, _ = _record(tmp_path)
+
+    assert login["u"] == launch["u"] == submit["u"]
+    assert login["i"] == launch["i"] == submit["i"]
+    assert launch["u"] != launch["i"]
@@ -0,0 +1,892 @@
+"""
+Admission Control Utilities
+Token-bucket rate limiting and outbound concurrency caps for the grading path
+
+Buckets live in a store shared by all Gunicorn workers (SQLite on the local
+disk, or Redis), so limits hold for the whole instance rather than per worker.
+Each store operation touches all the keys it needs in a single transaction
+(SQLite) or a single round trip (Redis); a grade submission's budget charge
+and its first slot attempt are one such operation.
+
+Outbound platform calls (grade deliveries and gradebook refreshes) share a
+fixed number of slots across all platforms. Under contention each platform
+with demand gets a share of the slots in proportion to its weight; a
+platform may borrow idle slots only while no other platform is queued
+below its share.
+
+Queued requests sleep inside their (sync) Gunicorn worker, so the number of
+waiters across all workers is capped as well; beyond the cap a request is
+rejected with 429 straight away instead of taking another worker.
+"""
+
+from contextlib import contextmanager
+import math
+import sqlite3
+import time
+import uuid
+
+from utils.resilience import remaining_time
+from utils.tenancy import tenant_stats
+
+# Platform statuses that mean "slow down"
+THROTTLE_STATUSES = (429, 503)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is over budget and should be answered with 429"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class QueueFull(AdmissionRejected):
+    """Raised when max_waiters requests are already queued for a slot"""
+
+    def __init__(self):
+        super().__init__("Platform queue is full", 1)
+
+
+def _refill(tokens, updated, rate, capacity, now):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _fair_grant(tenant, weight, tenant_limit, total, held, weights):
+    """
+    Decide whether `tenant` may take one more of `total` shared slots
+
+    Args:
+        held: tenant -> slots currently held
+        weights: tenant -> weight, for every configured tenant and every
+            tenant holding or awaiting a slot
+    """
+    weights = {**weights, tenant: weight}
+    total_held = sum(held.values())
+    if held.get(tenant, 0) >= tenant_limit or total_held >= total:
+        return False
+
+    weight_sum = sum(weights.values())
+
+    def share(name):
+        return max(1, int(total * weights[name] // weight_sum))
+
+    if held.get(tenant, 0) < share(tenant):
+        return True
+    # Borrowing: the unused share of every other tenant stays reserved, so a
+    # burst cannot take capacity a quieter platform is entitled to
+    reserved = sum(
+        max(0, share(name) - held.get(name, 0)) for name in weights if name != tenant
+    )
+    return total - total_held > reserved
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets, rate factors and shared outbound slots in a local SQLite file
+
+    Every operation runs in a BEGIN IMMEDIATE transaction, which serializes
+    writers across processes sharing the same file.
+    """
+
+    # Buckets untouched this long are full again and are deleted; a missing
+    # row reads as a full bucket, so purging never changes a decision
+    BUCKET_IDLE_SECONDS = 3600
+
+    def __init__(self, path):
+        self.path = path
+        self._purged_at = 0
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_buckets_updated ON buckets (updated)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS factors (key TEXT PRIMARY KEY, factor REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS slots "
+                "(lease_id TEXT PRIMARY KEY, tenant TEXT, weight INTEGER, expires REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS slot_waiters "
+                "(waiter_id TEXT PRIMARY KEY, tenant TEXT, weight INTEGER, expires REAL)"
+            )
+
+    @contextmanager
+    def _transaction(self, reject_when_busy=False):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                # Other workers held the write lock for the whole timeout;
+                # admission checks turn that into a 429 rather than a 500
+                if reject_when_busy:
+                    raise AdmissionRejected("Rate limit store is busy", 1) from e
+                raise
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _factor(self, conn, key):
+        row = conn.execute(
+            "SELECT factor FROM factors WHERE key = ?", (key,)
+        ).fetchone()
+        return 1.0 if row is None else row[0]
+
+    def _take_all(self, conn, buckets, now):
+        if now - self._purged_at > self.BUCKET_IDLE_SECONDS / 10:
+            conn.execute(
+                "DELETE FROM buckets WHERE updated < ?",
+                (now - self.BUCKET_IDLE_SECONDS,),
+            )
+            self._purged_at = now
+        states = []
+        for key, rate, capacity, factor_key in buckets:
+            if factor_key:
+                rate *= self._factor(conn, factor_key)
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens = capacity if row is None else row[0]
+            updated = now if row is None else row[1]
+            states.append((key, rate, _refill(tokens, updated, rate, capacity, now)))
+
+        rejected = next(
+            (index for index, (_, _, tokens) in enumerate(states) if tokens < 1),
+            None,
+        )
+        for key, _, tokens in states:
+            if rejected is None:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+
+        if rejected is None:
+            return None, 0
+        _, rate, tokens = states[rejected]
+        return rejected, (1 - tokens) / rate
+
+    def take_all(self, buckets):
+        with self._transaction(reject_when_busy=True) as conn:
+            return self._take_all(conn, buckets, time.time())
+
+    def take_all_and_acquire_slot(self, buckets, *slot_args):
+        """
+        take_all, then acquire_slot if every bucket had a token, in one
+        transaction; a full queue rolls the charge back
+
+        Returns:
+            tuple: (rejected bucket index or None, retry after, lease id or None)
+        """
+        now = time.time()
+        with self._transaction(reject_when_busy=True) as conn:
+            rejected, retry_after = self._take_all(conn, buckets, now)
+            if rejected is not None:
+                return rejected, retry_after, None
+            return None, 0, self._acquire_slot(conn, now, *slot_args)
+
+    def get_factor(self, key):
+        with self._transaction() as conn:
+            return self._factor(conn, key)
+
+    def acquire_slot(
+        self,
+        tenant,
+        weight,
+        tenant_limit,
+        total,
+        ttl,
+        waiter_id,
+        waiter_ttl,
+        max_waiters,
+        tenant_weights,
+    ):
+        """
+        Take a shared slot for `tenant`, or queue `waiter_id` for it
+
+        Raises AdmissionRejected when the caller is not queued yet and
+        `max_waiters` other requests already are.
+
+        Returns:
+            str: Lease id, or None if the caller was queued instead
+        """
+        now = time.time()
+        with self._transaction(reject_when_busy=True) as conn:
+            return self._acquire_slot(
+                conn,
+                now,
+                tenant,
+                weight,
+                tenant_limit,
+                total,
+                ttl,
+                waiter_id,
+                waiter_ttl,
+                max_waiters,
+                tenant_weights,
+            )
+
+    def _acquire_slot(
+        self,
+        conn,
+        now,
+        tenant,
+        weight,
+        tenant_limit,
+        total,
+        ttl,
+        waiter_id,
+        waiter_ttl,
+        max_waiters,
+        tenant_weights,
+    ):
+        conn.execute("DELETE FROM slots WHERE expires < ?", (now,))
+        conn.execute("DELETE FROM slot_waiters WHERE expires < ?", (now,))
+        held, waiting, weights = {}, {}, dict(tenant_weights)
+        for name, count, max_weight in conn.execute(
+            "SELECT tenant, COUNT(*), MAX(weight) FROM slots GROUP BY tenant"
+        ):
+            held[name] = count
+            weights[name] = max(weights.get(name, 0), max_weight)
+        for name, count, max_weight in conn.execute(
+            "SELECT tenant, COUNT(*), MAX(weight) FROM slot_waiters "
+            "WHERE waiter_id != ? GROUP BY tenant",
+            (waiter_id,),
+        ):
+            waiting[name] = count
+            weights[name] = max(weights.get(name, 0), max_weight)
+
+        if not _fair_grant(tenant, weight, tenant_limit, total, held, weights):
+            queued = conn.execute(
+                "SELECT 1 FROM slot_waiters WHERE waiter_id = ?", (waiter_id,)
+            ).fetchone()
+            if queued is None and sum(waiting.values()) >= max_waiters:
+                raise QueueFull()
+            conn.execute(
+                "INSERT OR REPLACE INTO slot_waiters (waiter_id, tenant, weight, expires) "
+                "VALUES (?, ?, ?, ?)",
+                (waiter_id, tenant, weight, now + waiter_ttl),
+            )
+            return None
+
+        lease_id = uuid.uuid4().hex
+        conn.execute("DELETE FROM slot_waiters WHERE waiter_id = ?", (waiter_id,))
+        conn.execute(
+            "INSERT INTO slots (lease_id, tenant, weight, expires) VALUES (?, ?, ?, ?)",
+            (lease_id, tenant, weight, now + ttl),
+        )
+        return lease_id
+
+    def cancel_wait(self, tenant, weight, waiter_id):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM slot_waiters "
+                "WHERE waiter_id = ? AND tenant = ? AND weight = ?",
+                (waiter_id, tenant, weight),
+            )
+
+    def release_slot(self, lease_id, factor_update=None):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE lease_id = ?", (lease_id,))
+            if factor_update:
+                factor_key, multiplier, increment, floor = factor_update
+                factor = self._factor(conn, factor_key) * multiplier + increment
+                conn.execute(
+                    "INSERT OR REPLACE INTO factors (key, factor) VALUES (?, ?)",
+                    (factor_key, max(floor, min(1.0, factor))),
+                )
+
+    def slot_usage(self):
+        """tenant -> {"held", "queued"} for tenants holding or awaiting slots"""
+        now = time.time()
+        usage = {}
+        with self._transaction() as conn:
+            for table, field in (("slots", "held"), ("slot_waiters", "queued")):
+                for name, count in conn.execute(
+                    f"SELECT tenant, COUNT(*) FROM {table} WHERE expires >= ? GROUP BY tenant",
+                    (now,),
+                ):
+                    usage.setdefault(name, {"held": 0, "queued": 0})[field] = count
+        return usage
+
+
+class RedisBucketStore:
+    """Token buckets, rate factors and shared outbound slots in Redis"""
+
+    # Refill buckets (each with its factor key, "" for none); returns the
+    # {tokens, rate, capacity} states and the 1-based index of the first
+    # bucket without a token (0 = none). store_buckets writes them back,
+    # charging one token each when `charge` is set.
+    BUCKETS_LUA = """
+local function refill_buckets(keys, factor_keys, limits, now)
+    local states = {}
+    local rejected = 0
+    for i = 1, #keys do
+        local rate = tonumber(limits[2 * i - 1])
+        local capacity = tonumber(limits[2 * i])
+        if factor_keys[i] ~= '' then
+            rate = rate * (tonumber(redis.call('GET', factor_keys[i])) or 1)
+        end
+        local state = redis.call('HMGET', keys[i], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + (now - updated) * rate)
+        if tokens < 1 and rejected == 0 then
+            rejected = i
+        end
+        states[i] = {tokens, rate, capacity}
+    end
+    return states, rejected
+end
+
+local function store_buckets(keys, states, now, charge)
+    for i = 1, #keys do
+        local tokens = states[i][1]
+        if charge then
+            tokens = tokens - 1
+        end
+        redis.call('HSET', keys[i], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', keys[i], math.ceil(states[i][3] / states[i][2]) + 60)
+    end
+end
+"""
+
+    # Drop expired slots and waiters, then grant a slot by weighted fair
+    # share (mirrors _fair_grant) or queue the caller, unless the caller is
+    # not queued yet and max waiters others already are.
+    # Members are "tenant\nweight\nid"
+    # args: now, tenant, weight, tenant limit, total, slot member,
+    #       slot expiry, waiter member, waiter expiry, key ttl, max waiters,
+    #       then a name and weight per configured tenant
+    # Returns 1 = granted, 0 = queued, -1 = queue full
+    SLOT_LUA = """
+local function acquire_slot(slots_key, waiters_key, args)
+    local now = tonumber(args[1])
+    redis.call('ZREMRANGEBYSCORE', slots_key, '-inf', now)
+    redis.call('ZREMRANGEBYSCORE', waiters_key, '-inf', now)
+    local tenant = args[2]
+    local held, weights = {}, {}
+    for i = 12, #args, 2 do
+        weights[args[i]] = tonumber(args[i + 1])
+    end
+    local total_held = 0
+    local total_waiting = 0
+    for _, member in ipairs(redis.call('ZRANGE', slots_key, 0, -1)) do
+        local name, weight = string.match(member, '^(.-)\\n(%d+)\\n')
+        held[name] = (held[name] or 0) + 1
+        weights[name] = math.max(weights[name] or 0, tonumber(weight))
+        total_held = total_held + 1
+    end
+    for _, member in ipairs(redis.call('ZRANGE', waiters_key, 0, -1)) do
+        if member ~= args[8] then
+            local name, weight = string.match(member, '^(.-)\\n(%d+)\\n')
+            total_waiting = total_waiting + 1
+            weights[name] = math.max(weights[name] or 0, tonumber(weight))
+        end
+    end
+    weights[tenant] = tonumber(args[3])
+    local total = tonumber(args[5])
+    local granted = false
+    if (held[tenant] or 0) < tonumber(args[4]) and total_held < total then
+        local weight_sum = 0
+        for _, weight in pairs(weights) do
+            weight_sum = weight_sum + weight
+        end
+        local function share(name)
+            return math.max(1, math.floor(total * weights[name] / weight_sum))
+        end
+        if (held[tenant] or 0) < share(tenant) then
+            granted = true
+        else
+            local reserved = 0
+            for name, _ in pairs(weights) do
+                if name ~= tenant then
+                    reserved = reserved + math.max(0, share(name) - (held[name] or 0))
+                end
+            end
+            granted = total - total_held > reserved
+        end
+    end
+    if granted then
+        redis.call('ZREM', waiters_key, args[8])
+        redis.call('ZADD', slots_key, args[7], args[6])
+        redis.call('EXPIRE', slots_key, args[10])
+        return 1
+    end
+    if not redis.call('ZSCORE', waiters_key, args[8])
+            and total_waiting >= tonumber(args[11]) then
+        return -1
+    end
+    redis.call('ZADD', waiters_key, args[9], args[8])
+    redis.call('EXPIRE', waiters_key, args[10])
+    return 0
+end
+"""
+
+    # Charge every bucket only if each has a token.
+    # KEYS: bucket keys followed by factor keys; ARGV: now, then a rate and
+    # capacity per bucket
+    # Returns {rejected index (0 = none, 1-based), tokens of rejected, rate}
+    TAKE_ALL_SCRIPT = (
+        BUCKETS_LUA
+        + """
+local count = #KEYS / 2
+local keys = {unpack(KEYS, 1, count)}
+local factor_keys = {unpack(KEYS, count + 1, 2 * count)}
+local now = tonumber(ARGV[1])
+local states, rejected = refill_buckets(keys, factor_keys, {unpack(ARGV, 2)}, now)
+store_buckets(keys, states, now, rejected == 0)
+if rejected == 0 then
+    return {0, '0', '1'}
+end
+return {rejected, tostring(states[rejected][1]), tostring(states[rejected][2])}
+"""
+    )
+
+    # KEYS: slots, waiters; ARGV: the args of acquire_slot
+    SLOT_SCRIPT = SLOT_LUA + "\nreturn acquire_slot(KEYS[1], KEYS[2], ARGV)\n"
+
+    # TAKE_ALL_SCRIPT then SLOT_SCRIPT in one call; nothing is charged when
+    # a bucket is empty or the queue is full.
+    # KEYS: slots, waiters, bucket keys, factor keys
+    # ARGV: bucket count, a rate and capacity per bucket, then the args of
+    #       acquire_slot
+    # Returns TAKE_ALL_SCRIPT's result plus the slot result (1, 0 or -1)
+    ADMIT_SLOT_SCRIPT = (
+        BUCKETS_LUA
+        + SLOT_LUA
+        + """
+local count = tonumber(ARGV[1])
+local keys = {unpack(KEYS, 3, 2 + count)}
+local factor_keys = {unpack(KEYS, 3 + count, 2 + 2 * count)}
+local limits = {unpack(ARGV, 2, 1 + 2 * count)}
+local args = {unpack(ARGV, 2 + 2 * count)}
+local now = tonumber(args[1])
+local states, rejected = refill_buckets(keys, factor_keys, limits, now)
+if rejected ~= 0 then
+    store_buckets(keys, states, now, false)
+    return {rejected, tostring(states[rejected][1]), tostring(states[rejected][2]), 0}
+end
+local acquired = acquire_slot(KEYS[1], KEYS[2], args)
+store_buckets(keys, states, now, acquired >= 0)
+return {0, '0', '1', acquired}
+"""
+    )
+
+    # Release a slot and apply an AIMD step to the factor in one call
+    RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+if KEYS[2] ~= '' then
+    local factor = tonumber(redis.call('GET', KEYS[2])) or 1
+    factor = factor * tonumber(ARGV[2]) + tonumber(ARGV[3])
+    factor = math.max(tonumber(ARGV[4]), math.min(1, factor))
+    redis.call('SET', KEYS[2], tostring(factor), 'EX', 3600)
+end
+return 1
+"""
+
+    def __init__(self, client, prefix="lti:admission:"):
+        self.client = client
+        self.prefix = prefix
+        self._take_all = client.register_script(self.TAKE_ALL_SCRIPT)
+        self._slot = client.register_script(self.SLOT_SCRIPT)
+        self._admit_slot = client.register_script(self.ADMIT_SLOT_SCRIPT)
+        self._release = client.register_script(self.RELEASE_SCRIPT)
+
+    def _bucket_keys(self, buckets):
+        keys, factor_keys, limits = [], [], []
+        for key, rate, capacity, factor_key in buckets:
+            keys.append(self.prefix + "bucket:" + key)
+            factor_keys.append(
+                self.prefix + "factor:" + factor_key if factor_key else ""
+            )
+            limits.extend([rate, capacity])
+        return keys + factor_keys, limits
+
+    @staticmethod
+    def _rejection(rejected, tokens, rate):
+        if not rejected:
+            return None, 0
+        return rejected - 1, (1 - float(tokens)) / float(rate)
+
+    def take_all(self, buckets):
+        keys, limits = self._bucket_keys(buckets)
+        return self._rejection(*self._take_all(keys=keys, args=[time.time(), *limits]))
+
+    def take_all_and_acquire_slot(self, buckets, *slot_args):
+        """
+        take_all, then acquire_slot if every bucket had a token, in one
+        script call; a full queue charges nothing
+
+        Returns:
+            tuple: (rejected bucket index or None, retry after, lease id or None)
+        """
+        keys, limits = self._bucket_keys(buckets)
+        lease, args = self._slot_args(*slot_args)
+        rejected, tokens, rate, acquired = self._admit_slot(
+            keys=[self.prefix + "slots", self.prefix + "slot_waiters", *keys],
+            args=[len(buckets), *limits, *args],
+        )
+        if rejected:
+            return (*self._rejection(rejected, tokens, rate), None)
+        if acquired < 0:
+            raise QueueFull()
+        return None, 0, lease if acquired else None
+
+    def get_factor(self, key):
+        value = self.client.get(self.prefix + "factor:" + key)
+        return 1.0 if value is None else float(value)
+
+    def _slot_args(
+        self,
+        tenant,
+        weight,
+        tenant_limit,
+        total,
+        ttl,
+        waiter_id,
+        waiter_ttl,
+        max_waiters,
+        tenant_weights,
+    ):
+        now = time.time()
+        lease = f"{tenant}\n{int(weight)}\n{uuid.uuid4().hex}"
+        return lease, [
+            now,
+            tenant,
+            int(weight),
+            tenant_limit,
+            total,
+            lease,
+            now + ttl,
+            f"{tenant}\n{int(weight)}\n{waiter_id}",
+            now + waiter_ttl,
+            math.ceil(max(ttl, waiter_ttl)),
+            max_waiters,
+            *(
+                value
+                for name, tenant_weight in tenant_weights.items()
+                for value in (name, int(tenant_weight))
+            ),
+        ]
+
+    def acquire_slot(
+        self,
+        tenant,
+        weight,
+        tenant_limit,
+        total,
+        ttl,
+        waiter_id,
+        waiter_ttl,
+        max_waiters,
+        tenant_weights,
+    ):
+        lease, args = self._slot_args(
+            tenant,
+            weight,
+            tenant_limit,
+            total,
+            ttl,
+            waiter_id,
+            waiter_ttl,
+            max_waiters,
+            tenant_weights,
+        )
+        acquired = self._slot(
+            keys=[self.prefix + "slots", self.prefix + "slot_waiters"], args=args
+        )
+        if acquired < 0:
+            raise QueueFull()
+        return lease if acquired else None
+
+    def cancel_wait(self, tenant, weight, waiter_id):
+        self.client.zrem(
+            self.prefix + "slot_waiters", f"{tenant}\n{int(weight)}\n{waiter_id}"
+        )
+
+    def release_slot(self, lease_id, factor_update=None):
+        factor_key, multiplier, increment, floor = factor_update or ("", 1, 0, 0)
+        self._release(
+            keys=[
+                self.prefix + "slots",
+                self.prefix + "factor:" + factor_key if factor_key else "",
+            ],
+            args=[lease_id, multiplier, increment, floor],
+        )
+
+    def slot_usage(self):
+        now = time.time()
+        usage = {}
+        for key, field in (("slots", "held"), ("slot_waiters", "queued")):
+            for member in self.client.zrangebyscore(self.prefix + key, now, "+inf"):
+                name = member.decode("utf-8").split("\n", 1)[0]
+                entry = usage.setdefault(name, {"held": 0, "queued": 0})
+                entry[field] += 1
+        return usage
+
+
+class OutboundSlot:
+    """A held platform slot; set status_code to adapt the issuer's rate"""
+
+    def __init__(self):
+        self.status_code = None
+
+
+class AdmissionController:
+    """
+    Admission control in front of the grading path
+
+    Requests must fit both a per-client and a per-issuer token bucket.
+    Outbound AGS calls also take one of `total_concurrency` slots shared by
+    all platforms (at most `platform_concurrency` per platform). Every
+    platform in `tenant_weights` keeps its weighted share of the slots
+    reserved, whether or not it is busy; others may only borrow what is left.
+    A call that finds no slot queues up to `queue_timeout` seconds if fewer
+    than `max_waiters` requests are queued across all workers (each waiter
+    holds a sync worker), and is rejected otherwise. When the platform
+    answers 429/503 the issuer's rate is halved (down to min_factor) and
+    then recovers additively on each success.
+    """
+
+    # Seconds a queued request stays counted without polling again
+    WAITER_TTL = 2
+
+    def __init__(
+        self,
+        store,
+        issuer_rate,
+        issuer_burst,
+        client_rate,
+        client_burst,
+        platform_concurrency,
+        total_concurrency=3,
+        queue_timeout=5.0,
+        max_waiters=0,
+        weight_for=None,
+        tenant_weights=None,
+        lease_ttl=30,
+        min_factor=0.1,
+        recovery_step=0.05,
+    ):
+        self.store = store
+        self.issuer_rate = issuer_rate
+        self.issuer_burst = issuer_burst
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.platform_concurrency = platform_concurrency
+        self.total_concurrency = total_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_waiters = max_waiters
+        self.weight_for = weight_for or (lambda _issuer: 1)
+        self.tenant_weights = tenant_weights or {}
+        self.lease_ttl = lease_ttl
+        self.min_factor = min_factor
+        self.recovery_step = recovery_step
+
+    def _buckets(self, client_key, issuer):
+        return [
+            ("client:" + client_key, self.client_rate, self.client_burst, None),
+            ("issuer:" + issuer, self.issuer_rate, self.issuer_burst, issuer),
+        ]
+
+    @staticmethod
+    def _check_budget(rejected, retry_after):
+        if rejected == 0:
+            raise AdmissionRejected("Too many grade submissions", retry_after)
+        if rejected == 1:
+            raise AdmissionRejected("Platform grading budget exhausted", retry_after)
+
+    def admit(self, client_key, issuer):
+        """
+        Charge the per-client and per-issuer buckets together or raise
+        AdmissionRejected; nothing is charged unless both have a token
+        """
+        self._check_budget(*self.store.take_all(self._buckets(client_key, issuer)))
+
+    def _factor_update(self, issuer, status_code):
+        if status_code in THROTTLE_STATUSES:
+            return issuer, 0.5, 0, self.min_factor
+        if status_code is not None and status_code < 400:
+            return issuer, 1, self.recovery_step, self.min_factor
+        return None
+
+    def _slot_args(self, issuer, weight, waiter_id, max_waiters):
+        return (
+            issuer,
+            weight,
+            self.platform_concurrency,
+            self.total_concurrency,
+            self.lease_ttl,
+            waiter_id,
+            self.WAITER_TTL,
+            max_waiters,
+            self.tenant_weights,
+        )
+
+    def _try_slot(self, issuer, weight, waiter_id, max_waiters):
+        return self.store.acquire_slot(
+            *self._slot_args(issuer, weight, waiter_id, max_waiters)
+        )
+
+    def _acquire_slot(self, issuer, weight, client_key=None):
+        waiter_id = uuid.uuid4().hex
+        wait_for = self.queue_timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            wait_for = min(wait_for, remaining)
+        deadline = time.monotonic() + wait_for
+        delay = 0.05
+        slot_args = self._slot_args(issuer, weight, waiter_id, self.max_waiters)
+        try:
+            if client_key is None:
+                lease_id = self.store.acquire_slot(*slot_args)
+            else:
+                rejected, retry_after, lease_id = self.store.take_all_and_acquire_slot(
+                    self._buckets(client_key, issuer), *slot_args
+                )
+                self._check_budget(rejected, retry_after)
+            while lease_id is None:
+                if time.monotonic() + delay > deadline:
+                    self.store.cancel_wait(issuer, weight, waiter_id)
+                    return None
+                time.sleep(delay)
+                delay = min(delay * 2, 0.4)
+                lease_id = self.store.acquire_slot(*slot_args)
+        except QueueFull:
+            return None
+        return lease_id
+
+    @contextmanager
+    def outbound_slot(self, issuer, kind="grade", client_key=None):
+        """
+        Hold one of the shared outbound platform slots
+
+        Waits in the issuer's queue for up to queue_timeout (bounded by the
+        request deadline) if fewer than max_waiters requests are queued,
+        otherwise rejects at once. The yielded OutboundSlot's status_code, if
+        set, adapts the issuer's rate when the slot is released.
+
+        Args:
+            issuer: Platform issuer the call goes to
+            kind: "grade" for deliveries, "refresh" for gradebook fetches;
+                wait times are reported per kind
+            client_key: If set, the client and issuer budgets are charged as
+                by admit(), in the same store call as the first slot attempt
+        """
+        started = time.monotonic()
+        lease_id = self._acquire_slot(issuer, self.weight_for(issuer), client_key)
+        tenant_stats.record(
+            issuer, f"{kind}_wait", time.monotonic() - started, error=lease_id is None
+        )
+        if lease_id is None:
+            raise AdmissionRejected("Too many concurrent requests to the platform", 1)
+        with self._held(issuer, lease_id) as slot:
+            yield slot
+
+    @contextmanager
+    def background_slot(self, issuer, kind):
+        """
+        Hold a shared slot for a background platform call if one is free now
+
+        Background calls (key set fetches, readiness probes) never queue and
+        never raise: they get None when the issuer has no slot to spare, and
+        the caller falls back to cached data instead of waiting.
+
+        Args:
+            issuer: Platform issuer the call goes to
+            kind: Call type, used to report wait times per kind
+        """
+        started = time.monotonic()
+        try:
+            lease_id = self._try_slot(
+                issuer, self.weight_for(issuer), uuid.uuid4().hex, 0
+            )
+        except AdmissionRejected:
+            lease_id = None
+        tenant_stats.record(
+            issuer, f"{kind}_wait", time.monotonic() - started, error=lease_id is None
+        )
+        if lease_id is None:
+            yield None
+            return
+        with self._held(issuer, lease_id) as slot:
+            yield slot
+
+    @contextmanager
+    def _held(self, issuer, lease_id):
+        slot = OutboundSlot()
+        try:
+            yield slot
+        finally:
+            self.store.release_slot(
+                lease_id, self._factor_update(issuer, slot.status_code)
+            )
+
+    def queue_depths(self):
+        """issuer -> {"held", "queued"} across all workers"""
+        return self.store.slot_usage()
+
+
+def create_admission_controller(app_config, tenants=None):
+    """
+    Build the admission controller described by the Flask config
+
+    Args:
+        app_config: Flask config mapping
+        tenants: Optional TenantRegistry supplying per-issuer weights
+
+    Returns:
+        AdmissionController: Controller, or None when rate limiting is disabled
+    """
+    if not app_config.get("GRADE_RATE_LIMIT_ENABLED", True):
+        return None
+
+    if app_config.get("RATE_LIMIT_STORAGE") == "redis":
+        from utils.redis_client import get_redis_client
+
+        store = RedisBucketStore(get_redis_client(app_config))
+    else:
+        store = SQLiteBucketStore(app_config["RATE_LIMIT_DB"])
+
+    return AdmissionController(
+        store,
+        issuer_rate=app_config["GRADE_ISSUER_RATE"],
+        issuer_burst=app_config["GRADE_ISSUER_BURST"],
+        client_rate=app_config["GRADE_CLIENT_RATE"],
+        client_burst=app_config["GRADE_CLIENT_BURST"],
+        platform_concurrency=app_config["GRADE_PLATFORM_CONCURRENCY"],
+        total_concurrency=app_config["GRADE_TOTAL_CONCURRENCY"],
+        queue_timeout=app_config["GRADE_QUEUE_TIMEOUT"],
+        max_waiters=app_config["GRADE_MAX_WAITERS"],
+        weight_for=tenants.weight if tenants else None,
+        tenant_weights=tenants.weights() if tenants else None,
+    )
+
+
+def get_client_key(claims):
+    """
+    Identify the calling client for per-client limits
+
+    Keys on the verified grade token's platform, client id and subject, so
+    the key cannot be changed by the caller (unlike X-Forwarded-For).
+
+    Args:
+        claims: Claims returned by verify_grade_token
+
+    Returns:
+        str: Per-learner key
+    """
+    return f"{claims.get('iss')}|{claims.get('aud')}|{claims.get('sub')}"
@@ -0,0 +1,320 @@
+"""
+Grade Ledger
+Append-only SQLite record of every grade submission outcome
+
+Writes are queued and flushed in batches by a background thread per worker;
+reads use keyset pagination and exports stream rows straight from a cursor.
+
+Pages are keyed on the autoincrement id alone. recorded_at is stamped when
+a row is queued, but rows are committed later by the batch writer, so a row
+with an earlier recorded_at can land after a client has paged past that
+time; ids only ever grow, so no committed row is skipped.
+"""
+
+import atexit
+from contextlib import contextmanager
+import csv
+from datetime import datetime, timezone
+import io
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "id",
+    "recorded_at",
+    "issuer",
+    "course_id",
+    "user_id",
+    "score",
+    "max_score",
+    "comment",
+    "outcome",
+    "status_code",
+    "error",
+    "lineitem",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grade_ledger (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at TEXT NOT NULL,
+    issuer TEXT,
+    course_id TEXT,
+    user_id TEXT,
+    score REAL,
+    max_score REAL,
+    comment TEXT,
+    outcome TEXT NOT NULL,
+    status_code INTEGER,
+    error TEXT,
+    lineitem TEXT
+);
+DROP INDEX IF EXISTS idx_grade_ledger_course_user_time;
+DROP INDEX IF EXISTS idx_grade_ledger_course_time;
+CREATE INDEX IF NOT EXISTS idx_grade_ledger_course_user_id
+    ON grade_ledger (course_id, user_id, id);
+CREATE INDEX IF NOT EXISTS idx_grade_ledger_course_id
+    ON grade_ledger (course_id, id);
+CREATE INDEX IF NOT EXISTS idx_grade_ledger_user_id
+    ON grade_ledger (user_id, id);
+CREATE TRIGGER IF NOT EXISTS grade_ledger_no_update
+    BEFORE UPDATE ON grade_ledger
+    BEGIN SELECT RAISE(ABORT, 'grade_ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS grade_ledger_no_delete
+    BEFORE DELETE ON grade_ledger
+    BEGIN SELECT RAISE(ABORT, 'grade_ledger is append-only'); END;
+"""
+
+# Non-text columns and their Python types; every other column is stored as text
+COLUMN_TYPES = {"score": float, "max_score": float, "status_code": int}
+
+# Rows fetched per cursor round-trip while streaming exports
+EXPORT_FETCH_SIZE = 500
+
+# Leading characters that make spreadsheets evaluate a cell as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def utc_timestamp():
+    """Fixed-width UTC timestamp that sorts lexically in time order"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def coerce_field(column, value):
+    """Convert a field to its column's type; unconvertible values become NULL"""
+    if value is None:
+        return None
+    try:
+        return COLUMN_TYPES.get(column, str)(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def csv_safe(value):
+    """Quote text a spreadsheet would run as a formula (CSV injection)"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def encode_cursor(row):
+    """Encode a keyset pagination cursor from the last row of a page"""
+    return str(row["id"])
+
+
+def decode_cursor(cursor):
+    """
+    Decode a keyset pagination cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    return int(cursor)
+
+
+class GradeLedger:
+    """
+    Append-only grade ledger backed by SQLite in WAL mode
+
+    record() only enqueues; a daemon thread inserts queued rows with
+    executemany in one transaction per batch. Pending rows are flushed at
+    interpreter exit.
+    """
+
+    def __init__(self, path, batch_size=50, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        with self._transaction() as conn:
+            conn.executescript(SCHEMA)
+        atexit.register(self.flush)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _ensure_writer(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._write_forever, name="grade-ledger", daemon=True
+            )
+            self._thread.start()
+
+    def record(self, **fields):
+        """Queue one outcome for insertion; never blocks on disk I/O"""
+        self._ensure_writer()
+        fields.setdefault("recorded_at", utc_timestamp())
+        self._queue.put(
+            tuple(coerce_field(column, fields.get(column)) for column in COLUMNS[1:])
+        )
+
+    def _drain(self, first=None):
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, batch):
+        if not batch:
+            return
+        placeholders = ", ".join("?" for _ in COLUMNS[1:])
+        with self._transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO grade_ledger ({', '.join(COLUMNS[1:])}) "
+                f"VALUES ({placeholders})",
+                batch,
+            )
+
+    def _write(self, batch):
+        """
+        Insert a batch, dropping only rows the database rejects
+
+        Returns:
+            list: Rows to retry later because the database was unavailable
+        """
+        try:
+            self._insert(batch)
+            return []
+        except (sqlite3.ProgrammingError, sqlite3.IntegrityError):
+            pass
+        except sqlite3.Error:
+            return batch
+
+        # One bad row fails the whole executemany; find it row by row
+        for index, row in enumerate(batch):
+            try:
+                self._insert([row])
+            except (sqlite3.ProgrammingError, sqlite3.IntegrityError) as e:
+                logger.error(f"Dropping grade ledger row the database rejected: {e}")
+            except sqlite3.Error:
+                return batch[index:]
+        return []
+
+    def _write_forever(self):
+        while True:
+            first = self._queue.get()
+            pending = self._write(self._drain(first))
+            if pending:
+                # Requeue and retry on the next tick rather than drop grades
+                for row in pending:
+                    self._queue.put(row)
+                threading.Event().wait(self.flush_interval)
+
+    def flush(self):
+        """Synchronously insert everything still queued in this process"""
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            pending = self._write(batch)
+            if pending:
+                logger.error(
+                    f"Grade ledger unavailable; {len(pending)} rows not written"
+                )
+                return
+
+    def _where(self, course_id=None, user_id=None, after=None):
+        clauses, params = [], []
+        if course_id is not None:
+            clauses.append("course_id = ?")
+            params.append(course_id)
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if after is not None:
+            clauses.append("id > ?")
+            params.append(decode_cursor(after))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def query(self, course_id=None, user_id=None, after=None, limit=100):
+        """
+        Fetch one page of ledger rows in id (commit) order
+
+        Args:
+            course_id: Restrict to one course
+            user_id: Restrict to one learner
+            after: Cursor returned as next_cursor by the previous page
+            limit: Maximum rows in the page
+
+        Returns:
+            tuple: (list of row dicts, next_cursor or None)
+        """
+        where, params = self._where(course_id, user_id, after)
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM grade_ledger {where} "
+                "ORDER BY id LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+
+        rows = [dict(row) for row in rows]
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def iter_csv(self, course_id=None, user_id=None):
+        """
+        Stream matching rows as CSV text chunks, one row per chunk
+
+        Rows are pulled from the cursor EXPORT_FETCH_SIZE at a time, so
+        memory use does not grow with the size of the export. Learner text
+        that starts like a formula is prefixed with a quote.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def take():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            return chunk
+
+        writer.writerow(COLUMNS)
+        yield take()
+
+        where, params = self._where(course_id, user_id)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM grade_ledger {where} ORDER BY id",
+                params,
+            )
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    writer.writerow(tuple(csv_safe(value) for value in row))
+                    yield take()
+        finally:
+            conn.close()
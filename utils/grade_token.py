@@ -0,0 +1,180 @@
+"""
+Grade Token Utilities
+Stateless, HMAC-signed tokens that carry everything needed to submit a grade
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from pylti1p3.assignments_grades import AssignmentsGradesService
+
+from utils.lti_utils import SharedTokenServiceConnector
+
+AGS_CLAIM = "https://purl.imsglobal.org/spec/lti-ags/claim/endpoint"
+NRPS_CLAIM = "https://purl.imsglobal.org/spec/lti-nrps/claim/namesroleservice"
+
+
+# What a token may be used for; each endpoint accepts exactly one use
+GRADE_USE = "grade"
+GRADEBOOK_USE = "gradebook"
+
+
+class GradeTokenError(Exception):
+    """Raised when a grade token is malformed, tampered with or expired"""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    padding = "=" * (-len(text) % 4)
+    return base64.urlsafe_b64decode(text + padding)
+
+
+def _sign(secret_key, payload):
+    return hmac.new(secret_key.encode("utf-8"), payload, hashlib.sha256).digest()
+
+
+def issue_grade_token(
+    secret_key,
+    message_launch,
+    user_id,
+    course_id,
+    ttl,
+    is_instructor=False,
+    use=GRADE_USE,
+):
+    """
+    Issue a compact signed grade token for a validated launch
+
+    Args:
+        secret_key: Application secret used to sign the token
+        message_launch: The validated LTI message launch object
+        user_id: LTI subject the grade will be submitted for
+        course_id: Course context the launch belongs to
+        ttl: Token lifetime in seconds
+        is_instructor: Whether the launching user is an instructor
+        use: GRADE_USE for /submit_grade, GRADEBOOK_USE for the gradebook
+
+    Returns:
+        str: Token in the form ``<payload>.<signature>``, or None without AGS
+    """
+    launch_data = message_launch.get_launch_data()
+    ags_endpoint = launch_data.get(AGS_CLAIM)
+    if not ags_endpoint:
+        return None
+
+    claims = {
+        "iss": launch_data.get("iss"),
+        "aud": launch_data.get("aud"),
+        "sub": user_id,
+        "course_id": course_id,
+        "ags": {
+            "scope": ags_endpoint.get("scope", []),
+            "lineitem": ags_endpoint.get("lineitem"),
+            "lineitems": ags_endpoint.get("lineitems"),
+        },
+        "nrps": (launch_data.get(NRPS_CLAIM) or {}).get("context_memberships_url"),
+        "instructor": bool(is_instructor),
+        "use": use,
+        "exp": int(time.time()) + int(ttl),
+    }
+
+    # aud may be a list; the first entry is the tool's client_id
+    if isinstance(claims["aud"], list):
+        claims["aud"] = claims["aud"][0] if claims["aud"] else None
+
+    payload = json.dumps(claims, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    signature = _sign(secret_key, payload)
+    return f"{_b64encode(payload)}.{_b64encode(signature)}"
+
+
+def verify_grade_token(secret_key, token, use=GRADE_USE):
+    """
+    Verify a grade token with a single HMAC check and return its claims
+
+    Args:
+        secret_key: Application secret the token was signed with
+        token: Token produced by issue_grade_token
+        use: The use the token must have been issued for
+
+    Returns:
+        dict: Decoded claims (iss, aud, sub, course_id, ags, nrps, instructor,
+        use, exp)
+
+    Raises:
+        GradeTokenError: If the token is malformed, tampered with, expired or
+        issued for another use
+    """
+    try:
+        payload_part, signature_part = token.split(".")
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (AttributeError, ValueError) as e:
+        raise GradeTokenError("Malformed grade token") from e
+
+    if not hmac.compare_digest(signature, _sign(secret_key, payload)):
+        raise GradeTokenError("Invalid grade token signature")
+
+    claims = json.loads(payload)
+    if claims.get("exp", 0) < time.time():
+        raise GradeTokenError("Grade token has expired")
+    if claims.get("use") != use:
+        raise GradeTokenError("Token is not valid for this request")
+
+    return claims
+
+
+def get_service_connector_from_grade_token(
+    claims, tool_conf, requests_session=None, token_cache=None, token_ttl=3000
+):
+    """
+    Build a platform service connector from verified grade token claims
+
+    Args:
+        claims: Claims returned by verify_grade_token
+        tool_conf: Tool configuration used to look up the platform registration
+        requests_session: Optional requests.Session for outbound service calls
+        token_cache: Optional shared cache for platform access tokens
+        token_ttl: Seconds to keep a cached access token
+
+    Returns:
+        ServiceConnector: Connector authenticated as the token's registration
+    """
+    iss = claims["iss"]
+    if tool_conf.check_iss_has_many_clients(iss):
+        registration = tool_conf.find_registration_by_params(iss, claims.get("aud"))
+    else:
+        registration = tool_conf.find_registration_by_issuer(iss)
+    if not registration:
+        raise GradeTokenError(f"No registration found for issuer {iss}")
+
+    return SharedTokenServiceConnector(
+        registration, requests_session, token_cache, token_ttl
+    )
+
+
+def get_ags_from_grade_token(
+    claims, tool_conf, requests_session=None, token_cache=None, token_ttl=3000
+):
+    """
+    Build an AGS service from verified grade token claims
+
+    Args:
+        claims: Claims returned by verify_grade_token
+        tool_conf: Tool configuration used to look up the platform registration
+        requests_session: Optional requests.Session for outbound AGS calls
+        token_cache: Optional shared cache for platform access tokens
+        token_ttl: Seconds to keep a cached access token
+
+    Returns:
+        AssignmentsGradesService: Service bound to the token's line item
+    """
+    connector = get_service_connector_from_grade_token(
+        claims, tool_conf, requests_session, token_cache, token_ttl
+    )
+    return AssignmentsGradesService(connector, claims["ags"])
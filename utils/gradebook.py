@@ -0,0 +1,198 @@
+"""
+Instructor Gradebook
+Merges the AGS results service with the course roster for instructors
+
+Results are cached per line item and the roster per course, in the issuer's
+partition of the cache shared by all workers, so repeated opens skip the
+platform entirely. Our own grade submissions invalidate the line item's
+cached results.
+"""
+
+from contextlib import nullcontext
+import hashlib
+
+RESULTS_ACCEPT = "application/vnd.ims.lis.v2.resultcontainer+json"
+MEMBERSHIPS_ACCEPT = "application/vnd.ims.lti-nrps.v2.membershipcontainer+json"
+RESULT_READ_SCOPE = "https://purl.imsglobal.org/spec/lti-ags/scope/result.readonly"
+NRPS_SCOPE = "https://purl.imsglobal.org/spec/lti-nrps/scope/contextmembership.readonly"
+
+
+def _cache_key(kind, url):
+    return f"gradebook:{kind}:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+
+def results_url_for(lineitem):
+    """Build the AGS results service URL for a line item URL"""
+    path, _, query = lineitem.partition("?")
+    path += "" if path.endswith("/") else "/"
+    return path + "results" + (f"?{query}" if query else "")
+
+
+def invalidate_results(cache, lineitem):
+    """Drop cached results for a line item after we submit a grade to it"""
+    if lineitem:
+        cache.delete(_cache_key("results", lineitem))
+
+
+class Gradebook:
+    """
+    Streams gradebook rows for one line item
+
+    Args:
+        cache: Shared cachelib cache
+        connector: ServiceConnector authenticated for the platform
+        ags_data: AGS endpoint claim (scope, lineitem)
+        memberships_url: NRPS context memberships URL, if the launch has one
+        results_ttl: Seconds to cache the line item's results
+        roster_ttl: Seconds to cache the course roster
+        fetch_slot: Optional context manager factory held around each page
+            fetched from the platform (the issuer's fair-share slot)
+    """
+
+    def __init__(
+        self,
+        cache,
+        connector,
+        ags_data,
+        memberships_url=None,
+        results_ttl=60,
+        roster_ttl=300,
+        fetch_slot=None,
+    ):
+        self.cache = cache
+        self.connector = connector
+        self.ags_data = ags_data
+        self.memberships_url = memberships_url
+        self.results_ttl = results_ttl
+        self.roster_ttl = roster_ttl
+        self.fetch_slot = fetch_slot or nullcontext
+        self._prefetched = {}
+
+    def prefetch(self):
+        """Read the cached roster and results in one cache round trip"""
+        keys = []
+        if self.memberships_url:
+            keys.append(_cache_key("roster", self.memberships_url))
+        if self.ags_data.get("lineitem"):
+            keys.append(_cache_key("results", self.ags_data["lineitem"]))
+        if keys:
+            self._prefetched = dict(zip(keys, self.cache.get_many(*keys)))
+
+    def _cache_get(self, key):
+        if key in self._prefetched:
+            return self._prefetched.pop(key)
+        return self.cache.get(key)
+
+    def can_read_results(self):
+        return bool(self.ags_data.get("lineitem")) and (
+            RESULT_READ_SCOPE in self.ags_data.get("scope", [])
+        )
+
+    def _fetch_pages(self, url, scopes, accept, extract):
+        while url:
+            with self.fetch_slot():
+                response = self.connector.make_service_request(
+                    scopes, url, accept=accept
+                )
+            yield extract(response["body"])
+            url = response["next_page_url"]
+
+    def get_roster(self):
+        """
+        Get course members keyed by user id (cached per course)
+
+        Returns:
+            dict: user_id -> {"name", "email", "roles"}
+        """
+        if not self.memberships_url:
+            return {}
+
+        key = _cache_key("roster", self.memberships_url)
+        roster = self._cache_get(key)
+        if roster is not None:
+            return roster
+
+        roster = {}
+        pages = self._fetch_pages(
+            self.memberships_url,
+            [NRPS_SCOPE],
+            MEMBERSHIPS_ACCEPT,
+            lambda body: (body or {}).get("members", []),
+        )
+        for members in pages:
+            for member in members:
+                roster[member.get("user_id")] = {
+                    "name": member.get("name", ""),
+                    "email": member.get("email", ""),
+                    "roles": member.get("roles", []),
+                }
+        self.cache.set(key, roster, timeout=self.roster_ttl)
+        return roster
+
+    def iter_result_pages(self):
+        """
+        Yield the line item's results page by page
+
+        Serves the cached result list when present; otherwise pages are
+        yielded as they arrive and the full list is cached afterwards.
+        """
+        lineitem = self.ags_data["lineitem"]
+        key = _cache_key("results", lineitem)
+        cached = self._cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        collected = []
+        pages = self._fetch_pages(
+            results_url_for(lineitem),
+            self.ags_data.get("scope", []),
+            RESULTS_ACCEPT,
+            lambda body: body if isinstance(body, list) else [],
+        )
+        for results in pages:
+            collected.extend(results)
+            yield results
+        self.cache.set(key, collected, timeout=self.results_ttl)
+
+    def iter_rows(self):
+        """
+        Yield merged gradebook rows: scored learners first, then learners
+        on the roster with no result yet
+
+        A platform failure mid-stream is yielded as a final row with an
+        "error" key instead of raising, since the response is already
+        being sent.
+        """
+        try:
+            self.prefetch()
+            roster = self.get_roster()
+            seen = set()
+            for results in self.iter_result_pages():
+                for result in results:
+                    user_id = result.get("userId")
+                    seen.add(user_id)
+                    member = roster.get(user_id, {})
+                    yield {
+                        "user_id": user_id,
+                        "name": member.get("name", ""),
+                        "email": member.get("email", ""),
+                        "score": result.get("resultScore"),
+                        "max_score": result.get("resultMaximum"),
+                        "comment": result.get("comment", ""),
+                    }
+
+            for user_id, member in roster.items():
+                is_learner = any("Learner" in role for role in member["roles"])
+                if user_id in seen or not is_learner:
+                    continue
+                yield {
+                    "user_id": user_id,
+                    "name": member["name"],
+                    "email": member["email"],
+                    "score": None,
+                    "max_score": None,
+                    "comment": "",
+                }
+        except Exception as e:
+            yield {"error": str(e)}
@@ -0,0 +1,210 @@
+"""
+Health Check Utilities
+Liveness/readiness support with dependency probes refreshed in the background
+
+Probes run on a daemon thread in each worker, so /readyz only returns the
+last pre-serialized result and a high probe rate never reaches the hot paths.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask.sessions import SessionInterface
+from pylti1p3.tool_config import ToolConfJsonFile
+
+LIVENESS_BODY = b'{"status":"ok"}'
+STARTING_BODY = b'{"status":"starting"}'
+
+
+class SkipPathsSessionInterface(SessionInterface):
+    """
+    Session interface that never opens or saves a session for some paths
+
+    Wraps the configured Flask-Session interface so probe endpoints do no
+    session I/O even if the caller sends a session cookie.
+    """
+
+    def __init__(self, inner, paths):
+        self.inner = inner
+        self.paths = frozenset(paths)
+
+    def open_session(self, app, request):
+        if request.path in self.paths:
+            return self.make_null_session(app)
+        return self.inner.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return None
+        return self.inner.save_session(app, session, response)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def unwrap_session_interface(interface):
+    """Get the Flask-Session interface beneath any wrapping interfaces"""
+    while hasattr(interface, "inner"):
+        interface = interface.inner
+    return interface
+
+
+class HealthMonitor:
+    """
+    Runs named dependency checks periodically and caches the serialized result
+
+    Each check is a callable returning a dict of details (or None) and raising
+    on failure. Only checks listed in `critical` make the instance not ready.
+    """
+
+    def __init__(self, checks, interval=30, critical=()):
+        self.checks = checks
+        self.interval = interval
+        self.critical = frozenset(critical)
+        self._body = None
+        self._status_code = 503
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def run_checks(self):
+        """Run every check once and store the serialized readiness report"""
+        results = {}
+        ready = True
+        for name, check in self.checks.items():
+            started = time.monotonic()
+            try:
+                details = check() or {}
+                result = {"status": "ok", **details}
+            except Exception as e:
+                result = {"status": "error", "error": str(e)}
+                if name in self.critical:
+                    ready = False
+            result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+            result["critical"] = name in self.critical
+            results[name] = result
+
+        report = {
+            "status": "ready" if ready else "not_ready",
+            "checked_at": int(time.time()),
+            "checks": results,
+        }
+        body = json.dumps(report, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._body = body
+            self._status_code = 200 if ready else 503
+
+    def _run_forever(self):
+        while True:
+            self.run_checks()
+            time.sleep(self.interval)
+
+    def ensure_started(self):
+        """Start the probe thread in this process (again after a fork)"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._body = None
+            self._thread = threading.Thread(
+                target=self._run_forever, name="health-probes", daemon=True
+            )
+            self._thread.start()
+
+    def snapshot(self):
+        """
+        Get the latest readiness report
+
+        Never probes inline: until the first background run finishes, the
+        worker reports itself as starting (503).
+
+        Returns:
+            tuple: (serialized JSON bytes, HTTP status code)
+        """
+        self.ensure_started()
+        with self._lock:
+            if self._body is None:
+                return STARTING_BODY, 503
+            return self._body, self._status_code
+
+
+def session_store_check(app):
+    """Check that the Flask-Session backend is reachable"""
+
+    def check():
+        interface = unwrap_session_interface(app.session_interface)
+        if hasattr(interface, "redis"):
+            interface.redis.ping()
+            return {"backend": "redis"}
+        if hasattr(interface, "cache"):
+            cache_dir = app.config["SESSION_FILE_DIR"]
+            if not os.access(cache_dir, os.W_OK):
+                raise RuntimeError(f"Session directory {cache_dir} is not writable")
+            return {"backend": "filesystem"}
+        return {"backend": type(interface).__name__}
+
+    return check
+
+
+def launch_storage_check(app):
+    """Round-trip a probe value through the store that backs launch data"""
+
+    def check():
+        interface = unwrap_session_interface(app.session_interface)
+        key = f"{interface.key_prefix}healthcheck:{uuid.uuid4().hex}"
+        if hasattr(interface, "redis"):
+            interface.redis.set(key, b"1", ex=60)
+            ok = interface.redis.get(key) == b"1"
+            interface.redis.delete(key)
+        elif hasattr(interface, "cache"):
+            interface.cache.set(key, "1", timeout=60)
+            ok = interface.cache.get(key) == "1"
+            interface.cache.delete(key)
+        else:
+            return {"skipped": True}
+        if not ok:
+            raise RuntimeError("Launch storage probe value could not be read back")
+        return None
+
+    return check
+
+
+def key_material_check(config_path):
+    """Check that the tool's keys load and produce a non-empty JWKS"""
+
+    def check():
+        tool_conf = ToolConfJsonFile(config_path)
+        keys = tool_conf.get_jwks().get("keys", [])
+        if not keys:
+            raise RuntimeError("No public keys configured")
+        return {"keys": len(keys)}
+
+    return check
+
+
+def platform_check(platform_session, tool_config_dict):
+    """Check that each platform's key set URL answers"""
+
+    def check():
+        hosts = {}
+        for issuer, registrations in tool_config_dict.items():
+            if isinstance(registrations, dict):
+                registrations = [registrations]
+            for registration in registrations:
+                key_set_url = registration.get("key_set_url")
+                if not key_set_url:
+                    continue
+                response = platform_session.get(key_set_url)
+                hosts[issuer] = response.status_code
+                if not response.ok:
+                    raise RuntimeError(
+                        f"{issuer} key set returned HTTP {response.status_code}"
+                    )
+        return {"platforms": hosts}
+
+    return check
@@ -4,9 +4,19 @@ Helper functions for LTI operations and data extraction
 """
 
 from datetime import datetime
+import hashlib
+import time
+from urllib.parse import parse_qs, urlparse
+import uuid
 
 from flask import session
+from pylti1p3.contrib.flask import FlaskMessageLaunch, FlaskOIDCLogin
+from pylti1p3.exception import LtiException, LtiServiceException
 from pylti1p3.launch_data_storage.session import SessionDataStorage
+from pylti1p3.service_connector import ServiceConnector
+
+from utils.replay_store import ReplayStoreSessionService
+from utils.tracing import tracer
 
 
 def get_launch_data_storage():
@@ -17,6 +27,190 @@ def get_launch_data_storage():
     return SessionDataStorage()
 
 
+class SharedTokenServiceConnector(ServiceConnector):
+    """
+    ServiceConnector whose platform access tokens are kept in a cache shared
+    by all workers, so each worker does not re-run the OAuth client
+    credentials exchange on every request
+
+    A cached token lives for token_ttl seconds at most, and never past the
+    platform's expires_in less EXPIRY_MARGIN. A 401 from the platform evicts
+    it and the call is retried once with a fresh token.
+    """
+
+    # Seconds before the platform's expiry at which a cached token is dropped
+    EXPIRY_MARGIN = 60
+
+    def __init__(
+        self, registration, requests_session=None, token_cache=None, token_ttl=3000
+    ):
+        super().__init__(registration, requests_session)
+        self._token_cache = token_cache
+        self._token_ttl = token_ttl
+
+    def _token_key(self, scopes):
+        scope_hash = hashlib.sha1("|".join(sorted(scopes)).encode("utf-8")).hexdigest()
+        return (
+            f"token:{self._registration.get_issuer()}:"
+            f"{self._registration.get_client_id()}:{scope_hash}"
+        )
+
+    def _request_access_token(self, scopes):
+        """
+        Run the client credentials exchange (as ServiceConnector does)
+
+        Returns:
+            tuple: (access token, expires_in seconds or None)
+        """
+        client_id = self._registration.get_client_id()
+        auth_url = self._registration.get_auth_token_url()
+        now = int(time.time())
+        assertion = self.encode_jwt(
+            {
+                "iss": str(client_id),
+                "sub": str(client_id),
+                "aud": str(self._registration.get_auth_audience() or auth_url),
+                "iat": now - 5,
+                "exp": now + 60,
+                "jti": "lti-service-token-" + str(uuid.uuid4()),
+            },
+            self._registration.get_tool_private_key(),
+            {"kid": self._registration.get_kid()}
+            if self._registration.get_kid()
+            else {},
+        )
+        response = self._requests_session.post(
+            auth_url,
+            data={
+                "grant_type": "client_credentials",
+                "client_assertion_type": "urn:ietf:params:oauth:client-assertion-type:jwt-bearer",
+                "client_assertion": assertion,
+                "scope": " ".join(sorted(scopes)),
+            },
+        )
+        if not response.ok:
+            raise LtiServiceException(response)
+        body = response.json()
+        return body["access_token"], body.get("expires_in")
+
+    def get_access_token(self, scopes):
+        if self._token_cache is None:
+            return super().get_access_token(scopes)
+
+        key = self._token_key(scopes)
+        token = self._token_cache.get(key)
+        if token is None:
+            with tracer.span("oauth.token_fetch"):
+                token, expires_in = self._request_access_token(scopes)
+            ttl = self._token_ttl
+            if expires_in is not None:
+                ttl = min(ttl, int(expires_in) - self.EXPIRY_MARGIN)
+            if ttl > 0:
+                self._token_cache.set(key, token, timeout=ttl)
+        return token
+
+    def make_service_request(self, scopes, url, *args, **kwargs):
+        try:
+            return super().make_service_request(scopes, url, *args, **kwargs)
+        except LtiServiceException as e:
+            if e.response.status_code != 401 or self._token_cache is None:
+                raise
+            # Revoked or expired early: drop it for every worker, retry once
+            self._token_cache.delete(self._token_key(scopes))
+            return super().make_service_request(scopes, url, *args, **kwargs)
+
+
+class ReplayProtectedOIDCLogin(FlaskOIDCLogin):
+    """
+    FlaskOIDCLogin that registers the nonce and state it issues in
+    replay_store (set once at startup) instead of the session
+    """
+
+    replay_store = None
+
+    def __init__(
+        self,
+        request,
+        tool_config,
+        session_service=None,
+        cookie_service=None,
+        launch_data_storage=None,
+    ):
+        if session_service is None and self.replay_store is not None:
+            session_service = ReplayStoreSessionService(request, self.replay_store)
+        super().__init__(
+            request, tool_config, session_service, cookie_service, launch_data_storage
+        )
+
+    def _prepare_redirect_url(self, launch_url):
+        url = super()._prepare_redirect_url(launch_url)
+        if isinstance(self._session_service, ReplayStoreSessionService):
+            state = parse_qs(urlparse(url).query)["state"][0]
+            self._session_service.save_state(state)
+        return url
+
+
+class TracedFlaskMessageLaunch(FlaskMessageLaunch):
+    """
+    FlaskMessageLaunch that records spans for JWT decoding, signature
+    verification and launch cache writes, shares platform access tokens
+    through the issuer's partition of token_caches, and accepts each state and nonce only once through
+    replay_store (both set once at startup)
+    """
+
+    token_caches = None
+    token_ttl = 3000
+    replay_store = None
+
+    def __init__(
+        self,
+        request,
+        tool_config,
+        session_service=None,
+        cookie_service=None,
+        launch_data_storage=None,
+        requests_session=None,
+    ):
+        if session_service is None and self.replay_store is not None:
+            session_service = ReplayStoreSessionService(request, self.replay_store)
+        super().__init__(
+            request,
+            tool_config,
+            session_service,
+            cookie_service,
+            launch_data_storage,
+            requests_session,
+        )
+
+    def validate_state(self):
+        super().validate_state()
+        replay_protected = isinstance(self._session_service, ReplayStoreSessionService)
+        state = self._get_request_param("state")
+        if replay_protected and not self._session_service.consume_state(state):
+            raise LtiException("State has already been used or has expired")
+        return self
+
+    def get_service_connector(self):
+        token_cache = None
+        if self.token_caches is not None:
+            token_cache = self.token_caches.for_issuer(self._registration.get_issuer())
+        return SharedTokenServiceConnector(
+            self._registration, self._requests_session, token_cache, self.token_ttl
+        )
+
+    def validate_jwt_format(self):
+        with tracer.span("jwt.decode"):
+            return super().validate_jwt_format()
+
+    def validate_jwt_signature(self):
+        with tracer.span("jwt.verify"):
+            return super().validate_jwt_signature()
+
+    def save_launch_data(self):
+        with tracer.span("launch_cache.write"):
+            return super().save_launch_data()
+
+
 def get_user_info(message_launch):
     """
     Extract user information from the LTI launch message
@@ -0,0 +1,63 @@
+"""
+Redis Integration
+One pooled Redis client per worker, shared by every Redis-backed component
+
+Sessions (and with them launch data), the per-tenant caches for gradebook
+data and platform access tokens, rate-limit buckets and replay protection
+all borrow connections from the same bounded pool, so a worker never opens
+more than REDIS_POOL_SIZE connections however many components use Redis.
+
+Multi-key operations are one round trip each; a grade submission's budget
+charge and slot acquisition share one script. The calls left in a request
+(see "Redis Round Trips per Request" in the README) are separated by the
+work that depends on them, such as the platform call a slot guards.
+"""
+
+import threading
+
+_client = None
+_lock = threading.Lock()
+
+
+def create_redis_client(app_config):
+    """
+    Build a Redis client over a bounded, blocking connection pool
+
+    Args:
+        app_config: Flask config mapping
+
+    Returns:
+        redis.Redis: Client whose callers wait up to REDIS_POOL_TIMEOUT for a
+        free connection instead of opening new ones
+    """
+    import redis
+
+    pool = redis.BlockingConnectionPool(
+        host=app_config["REDIS_HOST"],
+        port=app_config["REDIS_PORT"],
+        db=app_config["REDIS_DB"],
+        password=app_config["REDIS_PASSWORD"],
+        max_connections=app_config["REDIS_POOL_SIZE"],
+        timeout=app_config["REDIS_POOL_TIMEOUT"],
+        socket_timeout=app_config["REDIS_SOCKET_TIMEOUT"],
+        socket_connect_timeout=app_config["REDIS_CONNECT_TIMEOUT"],
+        socket_keepalive=True,
+        health_check_interval=app_config["REDIS_HEALTH_CHECK_INTERVAL"],
+        retry_on_timeout=False,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def get_redis_client(app_config):
+    """
+    Get the process's shared Redis client, creating it on first use
+
+    redis-py resets a pool's connections when it is first used in a forked
+    child, so Gunicorn workers never share sockets with the master process.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_redis_client(app_config)
+    return _client
@@ -0,0 +1,222 @@
+"""
+Replay Store
+Single-use OIDC state and id_token nonce tracking outside the session
+
+Values are registered at login and consumed once at launch, so a replayed
+id_token or state is rejected even if the session was lost, and sessions no
+longer accumulate one nonce key per login. Entries are grouped into time
+buckets; a bucket older than the TTL is dropped as a whole rather than
+scanning individual entries.
+"""
+
+from collections import OrderedDict
+import logging
+import sqlite3
+import threading
+import time
+
+from pylti1p3.contrib.flask import FlaskSessionService
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryReplayStore:
+    """
+    Per-process store for single-worker deployments
+
+    Holds at most `max_entries` values; when full, the oldest bucket is
+    evicted early. Evicted values then fail to consume, so an overloaded
+    store rejects launches rather than admitting replays.
+
+    Args:
+        ttl: Seconds a value stays consumable
+        bucket_seconds: Width of each expiry bucket
+        max_entries: Hard cap on stored values
+    """
+
+    def __init__(self, ttl=600, bucket_seconds=60, max_entries=200000):
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _bucket_id(self):
+        return int(time.time() // self.bucket_seconds)
+
+    def _drop_expired(self, current):
+        oldest_live = current - self.ttl // self.bucket_seconds
+        while self._buckets:
+            bucket_id, bucket = next(iter(self._buckets.items()))
+            if bucket_id >= oldest_live:
+                break
+            self._buckets.popitem(last=False)
+            self._size -= len(bucket)
+
+    def add(self, key):
+        current = self._bucket_id()
+        with self._lock:
+            self._drop_expired(current)
+            while self._size >= self.max_entries and self._buckets:
+                _, evicted = self._buckets.popitem(last=False)
+                self._size -= len(evicted)
+                logger.warning(
+                    f"Replay store full; evicted {len(evicted)} entries early"
+                )
+            bucket = self._buckets.get(current)
+            if bucket is None:
+                bucket = self._buckets[current] = set()
+            if key not in bucket:
+                bucket.add(key)
+                self._size += 1
+
+    def consume(self, key):
+        with self._lock:
+            self._drop_expired(self._bucket_id())
+            for bucket in self._buckets.values():
+                if key in bucket:
+                    bucket.discard(key)
+                    self._size -= 1
+                    return True
+        return False
+
+
+class SQLiteReplayStore:
+    """
+    Store shared by all workers through a local SQLite file
+
+    Each row carries its bucket number; consuming is one indexed DELETE and
+    expired buckets are purged by a range DELETE at most once per bucket.
+    """
+
+    def __init__(self, path, ttl=600, bucket_seconds=60):
+        self.path = path
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self._purged_bucket = None
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS replay_tokens "
+                "(key TEXT PRIMARY KEY, bucket INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_replay_tokens_bucket ON replay_tokens (bucket)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _oldest_live(self, current):
+        return current - self.ttl // self.bucket_seconds
+
+    def add(self, key):
+        current = int(time.time() // self.bucket_seconds)
+        conn = self._connect()
+        try:
+            if self._purged_bucket != current:
+                conn.execute(
+                    "DELETE FROM replay_tokens WHERE bucket < ?",
+                    (self._oldest_live(current),),
+                )
+                self._purged_bucket = current
+            conn.execute(
+                "INSERT OR REPLACE INTO replay_tokens (key, bucket) VALUES (?, ?)",
+                (key, current),
+            )
+        finally:
+            conn.close()
+
+    def consume(self, key):
+        current = int(time.time() // self.bucket_seconds)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "DELETE FROM replay_tokens WHERE key = ? AND bucket >= ?",
+                (key, self._oldest_live(current)),
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+
+class RedisReplayStore:
+    """
+    Store shared by all workers through Redis
+
+    Redis expires keys itself, so each value is one SET NX EX and consuming
+    is one DEL.
+    """
+
+    def __init__(self, client, ttl=600, prefix="lti:replay:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def add(self, key):
+        self.client.set(self.prefix + key, b"1", nx=True, ex=self.ttl)
+
+    def consume(self, key):
+        return self.client.delete(self.prefix + key) == 1
+
+
+class ReplayStoreSessionService(FlaskSessionService):
+    """
+    PyLTI1p3 session service keeping nonces and issued states in a replay
+    store instead of the Flask session
+
+    Launch data itself stays in the configured launch data storage.
+    """
+
+    def __init__(self, request, replay_store):
+        super().__init__(request)
+        self.replay_store = replay_store
+
+    def save_nonce(self, nonce):
+        self.replay_store.add("nonce:" + nonce)
+
+    def check_nonce(self, nonce):
+        return self.replay_store.consume("nonce:" + nonce)
+
+    def save_state(self, state):
+        self.replay_store.add("state:" + state)
+
+    def consume_state(self, state):
+        return self.replay_store.consume("state:" + state)
+
+    def set_state_valid(self, _state, _id_token_hash):
+        # States are single use; there is no "already validated" shortcut
+        return None
+
+    def check_state_is_valid(self, _state, _id_token_hash):
+        return False
+
+
+def create_replay_store(app_config):
+    """
+    Build the nonce/state replay store described by the Flask config
+
+    Args:
+        app_config: Flask config mapping
+
+    Returns:
+        Replay store with add(key) and consume(key)
+    """
+    backend = app_config.get("REPLAY_STORE")
+    ttl = app_config["REPLAY_TTL"]
+    if backend == "redis":
+        from utils.redis_client import get_redis_client
+
+        return RedisReplayStore(get_redis_client(app_config), ttl=ttl)
+    if backend == "memory":
+        return MemoryReplayStore(
+            ttl=ttl,
+            bucket_seconds=app_config["REPLAY_BUCKET_SECONDS"],
+            max_entries=app_config["REPLAY_MEMORY_MAX_ENTRIES"],
+        )
+    return SQLiteReplayStore(
+        app_config["REPLAY_DB"],
+        ttl=ttl,
+        bucket_seconds=app_config["REPLAY_BUCKET_SECONDS"],
+    )
@@ -0,0 +1,357 @@
+"""
+Platform Call Resilience
+Circuit breakers, request deadlines and hedged GETs for outbound platform calls
+
+PlatformSession is a drop-in requests.Session, so it can be handed to
+PyLTI1p3 (FlaskMessageLaunch, ServiceConnector) through requests_session.
+Breaker state is kept per worker process. Each registered platform host gets
+its own connection pool, sized by its tenant settings.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextvars
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.tenancy import tenant_stats
+from utils.tracing import current_trace, tracer
+
+# Absolute time.monotonic() deadline of the incoming request being served
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a platform host whose circuit is open"""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuit open for {host}; retry in {int(retry_after)}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised when the incoming request has no time left for an outbound call"""
+
+
+def set_deadline(seconds):
+    """Start the deadline for the current request, `seconds` from now"""
+    _deadline.set(time.monotonic() + seconds)
+
+
+def clear_deadline():
+    """Forget the current request's deadline"""
+    _deadline.set(None)
+
+
+def remaining_time():
+    """Seconds left before the current request's deadline, or None if unset"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for a single host
+
+    closed -> open after `failure_threshold` failures in a row; open ->
+    half_open once `reset_timeout` has passed, letting one trial call
+    through; the trial's outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+        }
+
+
+class PlatformSession(requests.Session):
+    """
+    requests.Session that guards every call to a platform host
+
+    - fails fast with CircuitOpenError while the host's circuit is open
+    - bounds each call's timeout by the incoming request's deadline
+    - optionally hedges idempotent GETs with a second, delayed attempt
+    - serves stale responses for registered URLs (JWKS) when the host fails
+    - records per-tenant call latency for hosts mapped with isolate_host
+    - with slot_for set, fetches registered URLs (JWKS) in a tenant slot,
+      serving the stale copy instead when the issuer has no slot to spare
+    """
+
+    def __init__(
+        self,
+        connect_timeout=3.0,
+        read_timeout=10.0,
+        failure_threshold=5,
+        reset_timeout=30.0,
+        hedge_delay=None,
+        max_stale=86400,
+        slot_for=None,
+    ):
+        super().__init__()
+        self.headers["User-Agent"] = "edx-lti-tool"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_delay = hedge_delay
+        self.max_stale = max_stale
+        self.slot_for = slot_for
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        self._stale_urls = set()
+        self._stale_responses = {}
+        self._hedge_pool = (
+            ThreadPoolExecutor(max_workers=4, thread_name_prefix="platform-hedge")
+            if hedge_delay
+            else None
+        )
+        self._host_issuers = {}
+
+    def isolate_host(self, host, issuer, pool_size):
+        """
+        Give a platform host its own connection pool and attribute its
+        calls to `issuer` in the tenant stats
+        """
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        for scheme in ("https", "http"):
+            self.mount(f"{scheme}://{host}/", adapter)
+        self._host_issuers[host] = issuer
+
+    def allow_stale(self, url):
+        """Allow a stale cached response for `url` while its host is failing"""
+        self._stale_urls.add(url)
+
+    def breaker_for(self, host):
+        with self._breakers_lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self._breakers[host]
+
+    def breaker_states(self):
+        """Snapshot of every known host's circuit state"""
+        with self._breakers_lock:
+            breakers = dict(self._breakers)
+        return {host: breaker.snapshot() for host, breaker in breakers.items()}
+
+    def _bounded_timeout(self, timeout):
+        connect, read = self.connect_timeout, self.read_timeout
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+        elif timeout is not None:
+            connect = read = timeout
+
+        remaining = remaining_time()
+        if remaining is None:
+            return connect, read
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded before platform call")
+        return min(connect, remaining), min(read, remaining)
+
+    def _stale_response(self, url):
+        cached = self._stale_responses.get(url)
+        if cached is None:
+            return None
+        stored_at, response = cached
+        if time.monotonic() - stored_at > self.max_stale:
+            return None
+        return response
+
+    def _hedged_get(self, method, url, **kwargs):
+        send = super().request
+        primary = self._hedge_pool.submit(send, method, url, **kwargs)
+        done, _ = wait([primary], timeout=self.hedge_delay)
+        if done:
+            return primary.result()
+
+        hedge = self._hedge_pool.submit(send, method, url, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+        raise error
+
+    def _span_name(self, method, url, data):
+        if isinstance(data, dict) and data.get("grant_type") == "client_credentials":
+            return "platform.token_fetch"
+        if url in self._stale_urls:
+            return "platform.jwks_fetch"
+        return f"platform.{method.lower()}"
+
+    def request(self, method, url, **kwargs):
+        with tracer.span(
+            self._span_name(method, url, kwargs.get("data")), **{"http.url": url}
+        ) as span:
+            trace = current_trace()
+            if trace is not None:
+                headers = dict(kwargs.get("headers") or {})
+                headers["traceparent"] = trace.traceparent()
+                kwargs["headers"] = headers
+            issuer = self._host_issuers.get(urlsplit(url).netloc)
+            started = time.monotonic()
+            try:
+                response = self._scheduled_request(issuer, method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                if issuer:
+                    tenant_stats.record(
+                        issuer, "platform", time.monotonic() - started, error=True
+                    )
+                raise
+            if issuer:
+                tenant_stats.record(
+                    issuer,
+                    "platform",
+                    time.monotonic() - started,
+                    error=response.status_code >= 500,
+                )
+            span.set_tag("http.status_code", response.status_code)
+            return response
+
+    def _scheduled_request(self, issuer, method, url, **kwargs):
+        if self.slot_for is None or issuer is None or url not in self._stale_urls:
+            return self._guarded_request(method, url, **kwargs)
+
+        with self.slot_for(issuer, "jwks") as slot:
+            if slot is None:
+                # Grading is using the issuer's slots; reuse the last key set
+                stale = self._stale_response(url)
+                if stale is not None:
+                    return stale
+            response = self._guarded_request(method, url, **kwargs)
+            if slot is not None:
+                slot.status_code = response.status_code
+            return response
+
+    def _guarded_request(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        breaker = self.breaker_for(host)
+        is_get = method.upper() == "GET"
+        stale = self._stale_response(url) if is_get else None
+
+        kwargs["timeout"] = self._bounded_timeout(kwargs.get("timeout"))
+        if not breaker.allow_request():
+            if stale is not None:
+                return stale
+            raise CircuitOpenError(host, breaker.retry_after())
+
+        try:
+            if is_get and self._hedge_pool is not None:
+                response = self._hedged_get(method, url, **kwargs)
+            else:
+                response = super().request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            breaker.record_failure()
+            if stale is not None:
+                return stale
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+            if stale is not None:
+                return stale
+        else:
+            breaker.record_success()
+            if is_get and response.ok and url in self._stale_urls:
+                self._stale_responses[url] = (time.monotonic(), response)
+        return response
+
+
+def create_platform_session(
+    app_config, tool_config_dict=None, tenants=None, slot_for=None
+):
+    """
+    Build the shared PlatformSession described by the Flask config
+
+    Args:
+        app_config: Flask config mapping
+        tool_config_dict: Parsed lti_config.json; its key_set_url entries may
+            be served stale while their host is down
+        tenants: Optional TenantRegistry; each of its platform hosts gets a
+            separate connection pool of the tenant's pool_size
+        slot_for: Optional AdmissionController.background_slot; key set
+            fetches then take a tenant slot (see PlatformSession)
+
+    Returns:
+        PlatformSession: Session to hand to PyLTI1p3 as requests_session
+    """
+    platform_session = PlatformSession(
+        connect_timeout=app_config["PLATFORM_CONNECT_TIMEOUT"],
+        read_timeout=app_config["PLATFORM_READ_TIMEOUT"],
+        failure_threshold=app_config["BREAKER_FAILURE_THRESHOLD"],
+        reset_timeout=app_config["BREAKER_RESET_TIMEOUT"],
+        hedge_delay=app_config["PLATFORM_HEDGE_DELAY"] or None,
+        max_stale=app_config["JWKS_MAX_STALE"],
+        slot_for=slot_for,
+    )
+
+    for registrations in (tool_config_dict or {}).values():
+        if isinstance(registrations, dict):
+            registrations = [registrations]
+        for registration in registrations:
+            if registration.get("key_set_url"):
+                platform_session.allow_stale(registration["key_set_url"])
+
+    if tenants is not None:
+        for host, issuer in tenants.hosts().items():
+            platform_session.isolate_host(
+                host, issuer, int(tenants.setting(issuer, "pool_size"))
+            )
+
+    return platform_session
@@ -0,0 +1,318 @@
+"""
+Tenant Isolation
+Per-issuer partitioning of outbound pools, caches and grading capacity
+
+Every platform issuer in lti_config.json is a tenant. Tenants get their own
+outbound connection pools, their own cache partition with an entry quota,
+and a weighted share of the instance's grading slots (see
+AdmissionController.outbound_slot), so one platform's grading burst cannot
+take the capacity other platforms' launches and grades depend on.
+"""
+
+from collections import deque
+from datetime import timedelta
+import hashlib
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from cachelib import FileSystemCache, RedisCache
+
+
+class TenantRegistry:
+    """
+    Per-issuer settings with defaults for issuers that are not listed
+
+    Args:
+        settings: issuer -> {"weight", "pool_size", "cache_quota"}
+        default_weight: Scheduling weight of unlisted issuers
+        default_pool_size: Outbound connections kept per host for unlisted issuers
+        default_cache_quota: Cache entries allowed for unlisted issuers
+    """
+
+    def __init__(
+        self,
+        settings=None,
+        default_weight=1,
+        default_pool_size=4,
+        default_cache_quota=1000,
+    ):
+        self.settings = settings or {}
+        self.defaults = {
+            "weight": default_weight,
+            "pool_size": default_pool_size,
+            "cache_quota": default_cache_quota,
+        }
+        self._hosts = {}
+        self._issuers = set()
+
+    def setting(self, issuer, name):
+        return (self.settings.get(issuer) or {}).get(name, self.defaults[name])
+
+    def weight(self, issuer):
+        return max(1, int(self.setting(issuer, "weight")))
+
+    @staticmethod
+    def tenant_id(issuer):
+        """Short stable id for an issuer, safe for paths and key prefixes"""
+        return hashlib.sha1((issuer or "").encode("utf-8")).hexdigest()[:12]
+
+    def register_hosts(self, tool_config_dict):
+        """Map each platform endpoint host in the tool config to its issuer"""
+        for issuer, registrations in (tool_config_dict or {}).items():
+            self._issuers.add(issuer)
+            if isinstance(registrations, dict):
+                registrations = [registrations]
+            for registration in registrations:
+                for field in ("auth_login_url", "auth_token_url", "key_set_url"):
+                    host = urlsplit(registration.get(field) or "").netloc
+                    if host:
+                        self._hosts[host] = issuer
+            if urlsplit(issuer).netloc:
+                self._hosts.setdefault(urlsplit(issuer).netloc, issuer)
+
+    def issuer_for_url(self, url):
+        """Issuer owning the host of an outbound URL, or None if unknown"""
+        return self._hosts.get(urlsplit(url).netloc)
+
+    def hosts(self):
+        """host -> issuer for every registered platform host"""
+        return dict(self._hosts)
+
+    def weights(self):
+        """issuer -> weight for every platform in the tool config"""
+        return {issuer: self.weight(issuer) for issuer in self._issuers}
+
+
+def load_tenant_registry(app_config, tool_config_dict=None):
+    """
+    Build the tenant registry described by the Flask config
+
+    Args:
+        app_config: Flask config mapping
+        tool_config_dict: Parsed lti_config.json, for host -> issuer lookups
+
+    Returns:
+        TenantRegistry: Registry with the configured per-issuer settings
+    """
+    registry = TenantRegistry(
+        app_config["TENANT_SETTINGS"],
+        default_weight=app_config["TENANT_DEFAULT_WEIGHT"],
+        default_pool_size=app_config["TENANT_POOL_SIZE"],
+        default_cache_quota=app_config["TENANT_CACHE_QUOTA"],
+    )
+    registry.register_hosts(tool_config_dict)
+    return registry
+
+
+class QuotaRedisCache(RedisCache):
+    """
+    RedisCache partition holding at most `quota` entries
+
+    Keys are indexed in a sorted set scored by expiry time. Each write
+    stores the value, drops expired index entries and evicts the entries
+    closest to expiry beyond the quota, all in one script call. Every
+    cachelib write method either goes through that script or is blocked,
+    and only cachelib's public attributes are used, so the index cannot
+    drift from the stored keys.
+    """
+
+    # KEYS: index, key; ARGV: value, ttl (-1 = none), expires_at, now, quota,
+    # only if absent (1/0). Returns -1 if the key existed, else keys evicted
+    SET_SCRIPT = """
+if ARGV[6] == '1' and redis.call('EXISTS', KEYS[2]) == 1 then
+    return -1
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+else
+    redis.call('SET', KEYS[2], ARGV[1])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[4])
+redis.call('ZADD', KEYS[1], ARGV[3], KEYS[2])
+local overflow = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[5])
+if overflow > 0 then
+    local victims = redis.call('ZRANGE', KEYS[1], 0, overflow - 1)
+    redis.call('DEL', unpack(victims))
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, overflow - 1)
+end
+return overflow > 0 and overflow or 0
+"""
+
+    # Entries without a timeout sort last, so they are evicted last
+    NO_EXPIRY_SCORE = 2**52
+
+    def __init__(self, client, key_prefix, quota):
+        super().__init__(host=client, key_prefix=key_prefix)
+        self.client = client
+        self.prefix = key_prefix
+        self.quota = quota
+        self._index = key_prefix + "__index__"
+        self._set = client.register_script(self.SET_SCRIPT)
+
+    def _ttl(self, timeout):
+        """Seconds to keep an entry, or -1 to keep it until evicted"""
+        if timeout is None:
+            timeout = self.default_timeout
+        if isinstance(timeout, timedelta):
+            timeout = timeout.total_seconds()
+        return int(timeout) if timeout > 0 else -1
+
+    def _store(self, key, value, timeout, only_if_absent):
+        ttl = self._ttl(timeout)
+        now = time.time()
+        return (
+            self._set(
+                keys=[self._index, self.prefix + key],
+                args=[
+                    self.serializer.dumps(value),
+                    ttl,
+                    now + ttl if ttl > 0 else self.NO_EXPIRY_SCORE,
+                    now,
+                    self.quota,
+                    1 if only_if_absent else 0,
+                ],
+            )
+            != -1
+        )
+
+    def set(self, key, value, timeout=None):
+        return self._store(key, value, timeout, only_if_absent=False)
+
+    def add(self, key, value, timeout=None):
+        return self._store(key, value, timeout, only_if_absent=True)
+
+    def set_many(self, mapping, timeout=None):
+        return [key for key, value in mapping.items() if self.set(key, value, timeout)]
+
+    def delete(self, key):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(self.prefix + key)
+        pipe.zrem(self._index, self.prefix + key)
+        return bool(pipe.execute()[0])
+
+    def delete_many(self, *keys):
+        if not keys:
+            return []
+        prefixed = [self.prefix + key for key in keys]
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(*prefixed)
+        pipe.zrem(self._index, *prefixed)
+        pipe.execute()
+        return list(keys)
+
+    def inc(self, key, delta=1):
+        raise NotImplementedError("Quota-bounded caches do not support counters")
+
+    def dec(self, key, delta=1):
+        raise NotImplementedError("Quota-bounded caches do not support counters")
+
+
+class TenantCaches:
+    """
+    One quota-bounded cache partition per issuer
+
+    Redis partitions share the worker's pooled client; filesystem partitions
+    are subdirectories whose threshold is the quota, so cachelib prunes
+    expired entries first and then the oldest.
+    """
+
+    def __init__(self, registry, redis_client=None, cache_dir="shared_cache"):
+        self.registry = registry
+        self.redis_client = redis_client
+        self.cache_dir = cache_dir
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def for_issuer(self, issuer):
+        """Get the issuer's cache partition, creating it on first use"""
+        cache = self._caches.get(issuer)
+        if cache is not None:
+            return cache
+        with self._lock:
+            if issuer not in self._caches:
+                tenant_id = self.registry.tenant_id(issuer)
+                quota = int(self.registry.setting(issuer, "cache_quota"))
+                if self.redis_client is not None:
+                    self._caches[issuer] = QuotaRedisCache(
+                        self.redis_client, f"lti:cache:{tenant_id}:", quota
+                    )
+                else:
+                    self._caches[issuer] = FileSystemCache(
+                        os.path.join(self.cache_dir, tenant_id), threshold=quota
+                    )
+            return self._caches[issuer]
+
+
+def create_tenant_caches(app_config, registry):
+    """
+    Build per-issuer caches for gradebook data and platform access tokens
+
+    Args:
+        app_config: Flask config mapping
+        registry: TenantRegistry supplying quotas
+
+    Returns:
+        TenantCaches: Redis-backed when sessions use Redis, else filesystem
+    """
+    if app_config.get("SESSION_TYPE") == "redis":
+        from utils.redis_client import get_redis_client
+
+        return TenantCaches(registry, redis_client=get_redis_client(app_config))
+    return TenantCaches(registry, cache_dir=app_config["SHARED_CACHE_DIR"])
+
+
+class TenantStats:
+    """
+    Per-worker latency samples per issuer and metric
+
+    Keeps the most recent `window` samples of each series, so percentiles
+    reflect current behaviour and memory stays bounded.
+    """
+
+    def __init__(self, window=512):
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, issuer, metric, seconds, error=False):
+        key = (issuer or "unknown", metric)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "samples": deque(maxlen=self.window),
+                    "count": 0,
+                    "errors": 0,
+                }
+            series["samples"].append(seconds)
+            series["count"] += 1
+            series["errors"] += 1 if error else 0
+
+    def snapshot(self):
+        """issuer -> metric -> {count, errors, p50_ms, p95_ms, max_ms}"""
+        with self._lock:
+            series = {
+                key: (sorted(value["samples"]), value["count"], value["errors"])
+                for key, value in self._series.items()
+            }
+
+        result = {}
+        for (issuer, metric), (samples, count, errors) in series.items():
+            result.setdefault(issuer, {})[metric] = {
+                "count": count,
+                "errors": errors,
+                "p50_ms": round(samples[len(samples) // 2] * 1000, 1)
+                if samples
+                else None,
+                "p95_ms": round(samples[int(len(samples) * 0.95)] * 1000, 1)
+                if samples
+                else None,
+                "max_ms": round(samples[-1] * 1000, 1) if samples else None,
+            }
+        return result
+
+
+# Process-wide stats, read by /api/status/tenants
+tenant_stats = TenantStats()
@@ -0,0 +1,342 @@
+"""
+Request Tracing
+Lightweight span trees for launch and grading requests
+
+Every request gets a trace id (from an incoming W3C traceparent header when
+present) that is attached to log records. Whether spans are recorded is
+decided once per request (head-based sampling), locally unless the upstream
+is trusted; unsampled requests only pay for a context variable lookup per
+span. Finished traces are exported as
+Zipkin v2 JSON spans, one per line.
+"""
+
+from contextlib import contextmanager
+import contextvars
+import importlib
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import random
+import threading
+import time
+
+from flask.sessions import SessionInterface
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "duration", "tags")
+
+    def __init__(self, trace, name, parent_id, tags):
+        self.trace = trace
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.tags = tags
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    def to_zipkin(self, service_name):
+        span = {
+            "traceId": self.trace.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.start * 1_000_000),
+            "duration": int((self.duration or 0) * 1_000_000),
+            "localEndpoint": {"serviceName": service_name},
+            "tags": {key: str(value) for key, value in self.tags.items()},
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """Spans collected for one request"""
+
+    def __init__(self, trace_id, sampled, parent_span_id=None):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.stack = []
+        self.remote_parent_id = parent_span_id
+
+    def current_span_id(self):
+        if self.stack:
+            return self.stack[-1].span_id
+        return self.remote_parent_id
+
+    def traceparent(self):
+        """W3C traceparent header value for outbound calls"""
+        span_id = self.current_span_id() or "0" * 16
+        return f"00-{self.trace_id}-{span_id}-{'01' if self.sampled else '00'}"
+
+
+class _NullSpan:
+    def set_tag(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Head-sampled tracer
+
+    Args:
+        exporter: Callable taking a list of Zipkin span dicts
+        sample_rate: Fraction of requests (0.0 - 1.0) whose spans are recorded
+        service_name: Service name reported on every span
+        trust_upstream: Follow the sampled flag of incoming traceparent
+            headers; otherwise only their trace id is kept, so external
+            callers cannot force sampling
+    """
+
+    def __init__(
+        self,
+        exporter=None,
+        sample_rate=0.01,
+        service_name="edx-lti-tool",
+        trust_upstream=False,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.trust_upstream = trust_upstream
+
+    def start_trace(self, traceparent=None):
+        """Begin a trace for the current request and make it current"""
+        trace_id, parent_id, sampled = None, None, None
+        if traceparent:
+            parts = traceparent.split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                trace_id, parent_id = parts[1], parts[2]
+                if self.trust_upstream:
+                    sampled = parts[3] == "01"
+
+        if trace_id is None:
+            trace_id = _new_id(16)
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        sampled = sampled and self.exporter is not None
+
+        trace = Trace(trace_id, sampled, parent_id)
+        _current_trace.set(trace)
+        return trace
+
+    def end_trace(self):
+        """Finish the current trace and export its spans if sampled"""
+        trace = _current_trace.get()
+        _current_trace.set(None)
+        if trace is None or not trace.sampled or not trace.spans:
+            return
+        while trace.stack:
+            trace.stack.pop().finish()
+        try:
+            self.exporter([span.to_zipkin(self.service_name) for span in trace.spans])
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Trace export failed: {str(e)}")
+
+    def start_span(self, name, **tags):
+        """Open a child of the current span; pair with finish_span()"""
+        trace = _current_trace.get()
+        if trace is None or not trace.sampled:
+            return _NULL_SPAN
+        span = Span(trace, name, trace.current_span_id(), tags)
+        trace.spans.append(span)
+        trace.stack.append(span)
+        return span
+
+    def finish_span(self, span):
+        """Close a span opened with start_span()"""
+        if span is _NULL_SPAN:
+            return
+        span.finish()
+        stack = span.trace.stack
+        if span in stack:
+            stack.remove(span)
+
+    @contextmanager
+    def span(self, name, **tags):
+        """Record a span around the enclosed block"""
+        span = self.start_span(name, **tags)
+        try:
+            yield span
+        except Exception as e:
+            span.set_tag("error", type(e).__name__)
+            raise
+        finally:
+            self.finish_span(span)
+
+
+def current_trace():
+    """The current request's trace, or None outside a request"""
+    return _current_trace.get()
+
+
+def current_trace_id():
+    """The current request's trace id, or "-" outside a request"""
+    trace = _current_trace.get()
+    return trace.trace_id if trace else "-"
+
+
+class TraceIdFilter(logging.Filter):
+    """Attach the current trace id to log records as %(trace_id)s"""
+
+    def filter(self, record):
+        record.trace_id = current_trace_id()
+        return True
+
+
+class RotatingFileExporter:
+    """
+    Write finished spans as JSON lines to size-rotated files, one per process
+
+    Rotation renames files, which is only safe with a single writer, so each
+    Gunicorn worker writes its own file with its PID inserted before the
+    extension (lti_traces.jsonl -> lti_traces.<pid>.jsonl). The file is
+    opened on first export, after any fork.
+    """
+
+    def __init__(self, path, max_bytes=10240000, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._handler = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def path_for(self, pid):
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{pid}{ext}"
+
+    def _handler_for_process(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._handler = RotatingFileHandler(
+                    self.path_for(os.getpid()),
+                    maxBytes=self.max_bytes,
+                    backupCount=self.backup_count,
+                )
+                self._handler.setFormatter(logging.Formatter("%(message)s"))
+                self._pid = os.getpid()
+            return self._handler
+
+    def __call__(self, spans):
+        handler = self._handler_for_process()
+        for span in spans:
+            handler.handle(
+                logging.makeLogRecord({"msg": json.dumps(span, separators=(",", ":"))})
+            )
+
+
+class TracedSessionInterface(SessionInterface):
+    """Session interface wrapper recording session read/write spans"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def open_session(self, app, request):
+        with tracer.span("session.read"):
+            return self.inner.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return None
+        with tracer.span("session.write"):
+            return self.inner.save_session(app, session, response)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+class TracingMiddleware:
+    """
+    WSGI middleware owning each request's root span
+
+    Runs outside Flask's request context so session loading is traced too;
+    the root span ends when the response body is closed, covering streams.
+    """
+
+    def __init__(self, wsgi_app, tracer):
+        self.wsgi_app = wsgi_app
+        self.tracer = tracer
+
+    def __call__(self, environ, start_response):
+        trace = self.tracer.start_trace(environ.get("HTTP_TRACEPARENT"))
+        root = self.tracer.start_span(
+            f"{environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')}"
+        )
+
+        def traced_start_response(status, headers, exc_info=None):
+            root.set_tag("http.status_code", status.split(" ", 1)[0])
+            headers.append(("X-Trace-Id", trace.trace_id))
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, traced_start_response)
+        except Exception:
+            self.tracer.end_trace()
+            raise
+        return _ClosingIterable(body, self.tracer)
+
+
+class _ClosingIterable:
+    def __init__(self, body, tracer):
+        self.body = body
+        self.tracer = tracer
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.tracer.end_trace()
+
+
+# Process-wide tracer; records nothing until configure_tracer() is called
+tracer = Tracer()
+
+
+def configure_tracer(app_config):
+    """
+    Configure the process-wide tracer from the Flask config
+
+    TRACE_EXPORTER is "file" (rotating JSON lines in one file per worker,
+    named after TRACE_FILE), "none", or
+    a "package.module:factory" path whose factory takes the config and
+    returns an exporter callable.
+    """
+    exporter_name = app_config.get("TRACE_EXPORTER", "file")
+    if exporter_name == "none":
+        exporter = None
+    elif exporter_name == "file":
+        exporter = RotatingFileExporter(app_config["TRACE_FILE"])
+    else:
+        module_name, _, factory_name = exporter_name.partition(":")
+        factory = getattr(importlib.import_module(module_name), factory_name)
+        exporter = factory(app_config)
+
+    tracer.exporter = exporter
+    tracer.sample_rate = app_config.get("TRACE_SAMPLE_RATE", 0.01)
+    tracer.service_name = app_config.get("TOOL_NAME", "edx-lti-tool")
+    tracer.trust_upstream = app_config.get("TRACE_TRUST_UPSTREAM", False)
+    return tracer
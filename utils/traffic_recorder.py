@@ -0,0 +1,193 @@
+"""
+Traffic Recorder
+Captures redacted shapes of real launch and grading traffic for replay
+
+Only what shapes load is kept: timing, status, roles, custom parameter
+sizes, AGS scopes and comment lengths. Identifiers (issuer, user, context,
+OIDC state) are replaced by keyed hashes that stay consistent within a
+trace, so a login, its launch and later grade submissions can be linked
+without recording who the user was. Names, emails, tokens, signatures and
+parameter values are never written.
+
+Records are JSON lines with short keys:
+    t   request start (epoch seconds)      d   duration (ms)
+    p   login | launch | submit            s   HTTP status
+    m   HTTP method (login)
+    i   issuer hash                        u   user hash
+    f   OIDC flow (state) hash             c   context hash
+    r   role URIs                          cp  custom parameter value sizes
+    mt  LTI message type                   ags AGS scopes (launch with AGS)
+    nrps  launch has NRPS                  n   request body bytes
+    tok submit used a grade token          cl  comment length
+    sr  score ratio (0.1 steps)            ms  max score
+"""
+
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+
+RECORDED_PATHS = {"/login": "login", "/launch": "launch", "/submit_grade": "submit"}
+
+LTI_CLAIM = "https://purl.imsglobal.org/spec/lti/claim/"
+AGS_CLAIM = "https://purl.imsglobal.org/spec/lti-ags/claim/endpoint"
+NRPS_CLAIM = "https://purl.imsglobal.org/spec/lti-nrps/claim/namesroleservice"
+
+
+class TrafficRecorder:
+    """
+    WSGI middleware appending one redacted record per recorded request
+
+    Args:
+        wsgi_app: Wrapped WSGI application
+        path: Trace file; all workers append to it, one write per line
+        secret_key: Key for identifier hashes (never written to the trace)
+        max_bytes: Recording stops once the trace file reaches this size
+    """
+
+    def __init__(self, wsgi_app, path, secret_key, max_bytes=104857600):
+        self.wsgi_app = wsgi_app
+        self.path = path
+        self.max_bytes = max_bytes
+        self._hash_key = hashlib.sha256(
+            b"traffic-recorder:" + secret_key.encode("utf-8")
+        ).digest()
+        self._lock = threading.Lock()
+
+    def _hash(self, value):
+        if not value:
+            return None
+        digest = hmac.new(self._hash_key, str(value).encode("utf-8"), hashlib.sha256)
+        return digest.hexdigest()[:12]
+
+    def __call__(self, environ, start_response):
+        kind = RECORDED_PATHS.get(environ.get("PATH_INFO"))
+        if kind is None or self._is_full():
+            return self.wsgi_app(environ, start_response)
+
+        started = time.time()
+        body = b""
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length:
+            body = environ["wsgi.input"].read(length)
+            environ["wsgi.input"] = io.BytesIO(body)
+
+        response = {}
+
+        def recording_start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["location"] = dict(headers).get("Location", "")
+            return start_response(status, headers, exc_info)
+
+        def finish():
+            try:
+                record = self._shape(kind, environ, body, response)
+            except Exception:
+                record = {}
+            record.update(
+                t=round(started, 3),
+                d=round((time.time() - started) * 1000, 1),
+                p=kind,
+                s=response.get("status"),
+            )
+            self._write(record)
+
+        return _RecordingIterable(
+            self.wsgi_app(environ, recording_start_response), finish
+        )
+
+    def _shape(self, kind, environ, body, response):
+        if kind == "login":
+            params = parse_qs(environ.get("QUERY_STRING", ""))
+            params.update(parse_qs(body.decode("utf-8", "replace")))
+            state = parse_qs(urlparse(response.get("location", "")).query).get("state")
+            return {
+                "m": environ.get("REQUEST_METHOD"),
+                "i": self._hash(_first(params, "iss")),
+                "u": self._hash(_first(params, "login_hint")),
+                "f": self._hash(state[0] if state else None),
+            }
+
+        if kind == "launch":
+            form = parse_qs(body.decode("utf-8", "replace"))
+            claims = jwt.decode(
+                _first(form, "id_token") or "", options={"verify_signature": False}
+            )
+            custom = claims.get(LTI_CLAIM + "custom") or {}
+            ags = claims.get(AGS_CLAIM)
+            return {
+                "i": self._hash(claims.get("iss")),
+                "u": self._hash(claims.get("sub")),
+                "f": self._hash(_first(form, "state")),
+                "c": self._hash((claims.get(LTI_CLAIM + "context") or {}).get("id")),
+                "r": claims.get(LTI_CLAIM + "roles", []),
+                "cp": [len(str(value)) for value in custom.values()],
+                "mt": claims.get(LTI_CLAIM + "message_type"),
+                "ags": ags.get("scope", []) if ags else None,
+                "nrps": NRPS_CLAIM in claims,
+                "n": len(body),
+            }
+
+        data = json.loads(body or b"{}")
+        token = data.get("grade_token")
+        user_id, issuer = data.get("user_id"), None
+        if token:
+            payload = token.split(".", 1)[0]
+            claims = json.loads(
+                base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+            )
+            user_id, issuer = claims.get("sub"), claims.get("iss")
+        score = float(data.get("score") or 0)
+        max_score = float(data.get("max_score") or 100)
+        return {
+            "i": self._hash(issuer),
+            "u": self._hash(user_id),
+            "tok": bool(token),
+            "cl": len(data.get("comment") or ""),
+            "sr": round(score / max_score, 1) if max_score else 0,
+            "ms": max_score,
+            "n": len(body),
+        }
+
+    def _is_full(self):
+        try:
+            return os.path.getsize(self.path) >= self.max_bytes
+        except OSError:
+            return False
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        # Appends of a single short line do not interleave across workers
+        with self._lock, open(self.path, "a", encoding="utf-8") as trace:
+            trace.write(line)
+
+
+def _first(params, key):
+    values = params.get(key)
+    return values[0] if values else None
+
+
+class _RecordingIterable:
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.on_close()
@@ -0,0 +1,632 @@
+"""
+Traffic Replay
+Re-issues a recorded traffic trace against a local instance of the tool
+
+Each recorded issuer is mapped to a stub platform served from this process,
+which signs fresh id_tokens shaped like the recorded launches (roles, custom
+parameter sizes, AGS scopes) and answers JWKS, OAuth token and AGS score
+calls. The tool under test only ever talks to the stub.
+
+Usage:
+    # 1. Generate stub platform keys and a tool config for the trace
+    python -m utils.traffic_replay prepare --trace traffic_trace.jsonl --out replay
+
+    # 2. Start the tool against the stub platforms
+    LTI_CONFIG_FILE=replay/lti_config.json FLASK_ENV=development \\
+        gunicorn -w 4 -b 127.0.0.1:5000 app:app
+
+    # 3. Replay at 10x speed and print latency/error report
+    python -m utils.traffic_replay run --trace traffic_trace.jsonl --state replay \\
+        --target http://127.0.0.1:5000 --speed 10
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import uuid
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+import jwt
+import requests
+
+from utils.traffic_recorder import AGS_CLAIM, LTI_CLAIM, NRPS_CLAIM
+
+PLATFORM_KID = "replay-platform"
+DEFAULT_ISSUER = "default"
+DEPLOYMENT_ID = "1"
+
+# How long a launch waits for its login, or a submission for its launch
+DEPENDENCY_TIMEOUT = 30
+
+GRADE_TOKEN_RE = re.compile(r'data-grade-token="([^"]*)"')
+
+
+def load_trace(path):
+    """
+    Load trace records sorted by start time
+
+    Args:
+        path: Trace file written by TrafficRecorder (optionally gzipped)
+
+    Returns:
+        list: Record dicts
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as trace_file:
+        for line in trace_file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def _write_key_pair(private_path, public_path=None):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(private_path, "wb") as key_file:
+        key_file.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    if public_path:
+        with open(public_path, "wb") as key_file:
+            key_file.write(
+                key.public_key().public_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PublicFormat.SubjectPublicKeyInfo,
+                )
+            )
+
+
+def prepare(trace_path, out_dir, stub_port):
+    """
+    Write stub platform keys and a tool config registering one stub
+    platform per issuer seen in the trace
+
+    Returns:
+        str: Path of the generated tool config
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    issuers = sorted(
+        {record.get("i") or DEFAULT_ISSUER for record in load_trace(trace_path)}
+    )
+
+    _write_key_pair(os.path.join(out_dir, "platform_private.key"))
+    _write_key_pair(
+        os.path.join(out_dir, "tool_private.key"),
+        os.path.join(out_dir, "tool_public.key"),
+    )
+
+    base_url = f"http://127.0.0.1:{stub_port}"
+    tool_config = {}
+    for issuer in issuers:
+        platform_url = f"{base_url}/{issuer}"
+        tool_config[platform_url] = {
+            "client_id": f"replay-{issuer}",
+            "auth_login_url": f"{platform_url}/auth",
+            "auth_token_url": f"{platform_url}/token",
+            "auth_audience": None,
+            "key_set_url": f"{platform_url}/jwks",
+            "key_set": None,
+            "private_key_file": "tool_private.key",
+            "public_key_file": "tool_public.key",
+            "deployment_ids": [DEPLOYMENT_ID],
+        }
+
+    config_path = os.path.join(out_dir, "lti_config.json")
+    with open(config_path, "w", encoding="utf-8") as config_file:
+        json.dump(tool_config, config_file, indent=2)
+    return config_path
+
+
+class StubPlatform:
+    """
+    Minimal LTI platform: JWKS, OAuth tokens, AGS scores/results and NRPS
+
+    Args:
+        state_dir: Directory written by prepare()
+        latency: Seconds added to every platform response
+    """
+
+    def __init__(self, state_dir, latency=0.0):
+        with open(
+            os.path.join(state_dir, "lti_config.json"), encoding="utf-8"
+        ) as config_file:
+            self.tool_config = json.load(config_file)
+        with open(os.path.join(state_dir, "platform_private.key"), "rb") as key_file:
+            self.private_key = serialization.load_pem_private_key(key_file.read(), None)
+        self.latency = latency
+
+        jwk = json.loads(
+            jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key())
+        )
+        jwk.update(kid=PLATFORM_KID, alg="RS256", use="sig")
+        self.jwks = json.dumps({"keys": [jwk]}).encode("utf-8")
+
+        port = urlparse(next(iter(self.tool_config))).port
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+
+    def issuer_url(self, issuer_hash):
+        base = next(iter(self.tool_config)).rsplit("/", 1)[0]
+        url = f"{base}/{issuer_hash or DEFAULT_ISSUER}"
+        if url not in self.tool_config:
+            raise KeyError(
+                f"Issuer {issuer_hash} is not in the prepared config; re-run prepare"
+            )
+        return url
+
+    def sign(self, claims):
+        return jwt.encode(
+            claims, self.private_key, algorithm="RS256", headers={"kid": PLATFORM_KID}
+        )
+
+    def start(self):
+        threading.Thread(
+            target=self.server.serve_forever, name="stub-platform", daemon=True
+        ).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _handler_class(self):
+        platform = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                if platform.latency:
+                    time.sleep(platform.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path.endswith("/jwks"):
+                    self._send(200, platform.jwks)
+                elif path.endswith("/results"):
+                    self._send(
+                        200, b"[]", "application/vnd.ims.lis.v2.resultcontainer+json"
+                    )
+                elif "/memberships/" in path:
+                    self._send(
+                        200,
+                        b'{"members":[]}',
+                        "application/vnd.ims.lti-nrps.v2.membershipcontainer+json",
+                    )
+                else:
+                    self._send(404, b"{}")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = urlparse(self.path).path
+                if path.endswith("/token"):
+                    scope = parse_qs(body.decode("utf-8")).get("scope", [""])[0]
+                    token = {
+                        "access_token": uuid.uuid4().hex,
+                        "token_type": "Bearer",
+                        "expires_in": 3600,
+                        "scope": scope,
+                    }
+                    self._send(200, json.dumps(token).encode("utf-8"))
+                elif path.endswith("/scores"):
+                    self._send(200, b"{}")
+                else:
+                    self._send(404, b"{}")
+
+        return Handler
+
+
+class Replayer:
+    """
+    Schedules trace records against the target at the recorded pace
+
+    Logins, launches and submissions are linked through the trace's flow and
+    user hashes: a launch reuses its login's cookies, state and nonce, and a
+    submission uses the grade token (or session) of the user's latest launch.
+    """
+
+    def __init__(self, platform, target, speed=1.0, concurrency=64, timeout=30):
+        self.platform = platform
+        self.target = target.rstrip("/")
+        self.speed = speed
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.samples = []
+        self.lags = []
+        self._flows = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, table, key):
+        with self._lock:
+            if key not in table:
+                table[key] = {"ready": threading.Event(), "value": None}
+            return table[key]
+
+    def _sample(self, kind, started, status, error=None):
+        with self._lock:
+            self.samples.append(
+                {
+                    "p": kind,
+                    "d": (time.monotonic() - started) * 1000,
+                    "s": status,
+                    "error": error,
+                }
+            )
+
+    def _login(self, record, http=None):
+        http = http or requests.Session()
+        issuer = self.platform.issuer_url(record.get("i"))
+        params = {
+            "iss": issuer,
+            "client_id": self.platform.tool_config[issuer]["client_id"],
+            "login_hint": record.get("u") or uuid.uuid4().hex,
+            "target_link_uri": f"{self.target}/launch",
+        }
+        started = time.monotonic()
+        if record.get("m") == "POST":
+            response = http.post(
+                f"{self.target}/login",
+                data=params,
+                allow_redirects=False,
+                timeout=self.timeout,
+            )
+        else:
+            response = http.get(
+                f"{self.target}/login",
+                params=params,
+                allow_redirects=False,
+                timeout=self.timeout,
+            )
+        self._sample(
+            "login",
+            started,
+            response.status_code,
+            None if response.status_code < 400 else response.reason,
+        )
+        query = parse_qs(urlparse(response.headers.get("Location", "")).query)
+        return {
+            "http": http,
+            "issuer": issuer,
+            "state": query.get("state", [None])[0],
+            "nonce": query.get("nonce", [None])[0],
+        }
+
+    def _id_token(self, record, flow):
+        issuer = flow["issuer"]
+        lineitems = f"{issuer}/lineitems/{record.get('c') or 'course'}"
+        now = int(time.time())
+        user = record.get("u") or uuid.uuid4().hex
+        claims = {
+            "iss": issuer,
+            "aud": self.platform.tool_config[issuer]["client_id"],
+            "sub": user,
+            "iat": now,
+            "exp": now + 300,
+            "nonce": flow["nonce"],
+            "name": f"Replay {user[:6]}",
+            "email": f"{user}@replay.invalid",
+            LTI_CLAIM + "message_type": record.get("mt") or "LtiResourceLinkRequest",
+            LTI_CLAIM + "version": "1.3.0",
+            LTI_CLAIM + "deployment_id": DEPLOYMENT_ID,
+            LTI_CLAIM + "target_link_uri": f"{self.target}/launch",
+            LTI_CLAIM + "roles": record.get("r") or [],
+            LTI_CLAIM + "context": {
+                "id": record.get("c") or "course",
+                "title": "Replay course",
+            },
+            LTI_CLAIM + "custom": {
+                f"param_{index}": "x" * size
+                for index, size in enumerate(record.get("cp") or [])
+            },
+        }
+        if claims[LTI_CLAIM + "message_type"] == "LtiDeepLinkingRequest":
+            claims[
+                "https://purl.imsglobal.org/spec/lti-dl/claim/deep_linking_settings"
+            ] = {
+                "deep_link_return_url": f"{issuer}/deep_link",
+                "accept_types": ["ltiResourceLink"],
+                "accept_presentation_document_targets": ["iframe", "window"],
+            }
+        else:
+            claims[LTI_CLAIM + "resource_link"] = {
+                "id": f"link-{record.get('c') or 'course'}"
+            }
+        if record.get("ags") is not None:
+            claims[AGS_CLAIM] = {
+                "scope": record["ags"],
+                "lineitems": lineitems,
+                "lineitem": f"{lineitems}/lineitem",
+            }
+        if record.get("nrps"):
+            claims[NRPS_CLAIM] = {
+                "context_memberships_url": f"{issuer}/memberships/{record.get('c') or 'course'}",
+                "service_versions": ["2.0"],
+            }
+        return self.platform.sign(claims)
+
+    def _launch(self, record):
+        flow = None
+        if record.get("_after_login"):
+            slot = self._slot(self._flows, record["f"])
+            if slot["ready"].wait(DEPENDENCY_TIMEOUT):
+                flow = slot["value"]
+        if not flow or not flow.get("state"):
+            # Login was not recorded (or failed); log in first, untimed for the launch
+            flow = self._login(record)
+
+        started = time.monotonic()
+        response = flow["http"].post(
+            f"{self.target}/launch",
+            data={"state": flow["state"], "id_token": self._id_token(record, flow)},
+            timeout=self.timeout,
+        )
+        self._sample(
+            "launch",
+            started,
+            response.status_code,
+            None if response.status_code < 400 else response.reason,
+        )
+
+        grade_token = GRADE_TOKEN_RE.search(response.text)
+        return {
+            "http": flow["http"],
+            "grade_token": grade_token.group(1) if grade_token else None,
+        }
+
+    def _submit(self, record):
+        if not record.get("_after_launch"):
+            self._sample(
+                "submit", time.monotonic(), None, "no recorded launch for user"
+            )
+            return None
+        slot = self._slot(self._users, record["u"])
+        if not slot["ready"].wait(DEPENDENCY_TIMEOUT) or not slot["value"]:
+            self._sample("submit", time.monotonic(), None, "launch for user failed")
+            return None
+
+        launch = slot["value"]
+        max_score = record.get("ms") or 100
+        payload = {
+            "score": round((record.get("sr") or 0) * max_score, 2),
+            "max_score": max_score,
+            "comment": "x" * (record.get("cl") or 0),
+            # Tokenless submits are no longer accepted; replay them with the token
+            "grade_token": launch["grade_token"],
+        }
+
+        started = time.monotonic()
+        response = launch["http"].post(
+            f"{self.target}/submit_grade", json=payload, timeout=self.timeout
+        )
+        self._sample(
+            "submit",
+            started,
+            response.status_code,
+            None if response.status_code < 400 else response.reason,
+        )
+        return None
+
+    def _run_record(self, record):
+        kind = record.get("p")
+        try:
+            if kind == "login" and record.get("f"):
+                slot = self._slot(self._flows, record["f"])
+                try:
+                    slot["value"] = self._login(record)
+                finally:
+                    slot["ready"].set()
+            elif kind == "login":
+                self._login(record)
+            elif kind == "launch" and record.get("u"):
+                slot = self._slot(self._users, record["u"])
+                try:
+                    slot["value"] = self._launch(record)
+                finally:
+                    slot["ready"].set()
+            elif kind == "launch":
+                self._launch(record)
+            elif kind == "submit":
+                self._submit(record)
+        except Exception as e:
+            self._sample(kind, time.monotonic(), None, f"{type(e).__name__}: {str(e)}")
+
+    def run(self, records):
+        """
+        Replay records at `speed` times the recorded pace
+
+        Returns:
+            float: Wall-clock seconds the replay took
+        """
+        if not records:
+            return 0.0
+
+        # Only wait on a login/launch that precedes the record in the trace
+        logged_in, launched = set(), set()
+        for record in records:
+            if record.get("p") == "login" and record.get("f"):
+                logged_in.add(record["f"])
+            elif record.get("p") == "launch":
+                record["_after_login"] = record.get("f") in logged_in
+                if record.get("u"):
+                    launched.add(record["u"])
+            elif record.get("p") == "submit":
+                record["_after_launch"] = record.get("u") in launched
+
+        first = records[0]["t"]
+        replay_start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for record in records:
+                due = replay_start + (record["t"] - first) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.lags.append(max(0.0, -delay) * 1000)
+                executor.submit(self._run_record, record)
+        return time.monotonic() - replay_start
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def build_report(records, samples, lags, elapsed):
+    """
+    Summarize replayed latencies and errors next to the recorded ones
+
+    Returns:
+        dict: Per-endpoint counts, error rates and latency percentiles (ms)
+    """
+    report = {"elapsed_seconds": round(elapsed, 1), "endpoints": {}}
+    for kind in ("login", "launch", "submit"):
+        replayed = [sample for sample in samples if sample["p"] == kind]
+        if not replayed:
+            continue
+        recorded = [
+            record["d"]
+            for record in records
+            if record.get("p") == kind and "d" in record
+        ]
+        latencies = [sample["d"] for sample in replayed if sample["s"] is not None]
+        errors = [sample for sample in replayed if sample["error"]]
+        statuses = {}
+        for sample in replayed:
+            statuses[str(sample["s"])] = statuses.get(str(sample["s"]), 0) + 1
+        report["endpoints"][kind] = {
+            "count": len(replayed),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(replayed), 4),
+            "statuses": statuses,
+            "replayed_ms": {
+                name: round(percentile(latencies, fraction) or 0, 1)
+                for name, fraction in (
+                    ("p50", 0.5),
+                    ("p90", 0.9),
+                    ("p99", 0.99),
+                    ("max", 1.0),
+                )
+            },
+            "recorded_ms": {
+                name: round(percentile(recorded, fraction) or 0, 1)
+                for name, fraction in (
+                    ("p50", 0.5),
+                    ("p90", 0.9),
+                    ("p99", 0.99),
+                    ("max", 1.0),
+                )
+            },
+            "sample_errors": sorted({error["error"] for error in errors})[:5],
+        }
+    report["schedule_lag_ms"] = {
+        "p50": round(percentile(lags, 0.5) or 0, 1),
+        "p99": round(percentile(lags, 0.99) or 0, 1),
+    }
+    return report
+
+
+def print_report(report):
+    """Print a replay report as a fixed-width table"""
+    print(
+        f"Replay finished in {report['elapsed_seconds']}s "
+        f"(schedule lag p50={report['schedule_lag_ms']['p50']}ms "
+        f"p99={report['schedule_lag_ms']['p99']}ms)"
+    )
+    print(
+        f"{'endpoint':<10}{'count':>8}{'err%':>8}"
+        f"{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}   recorded p50/p99"
+    )
+    for kind, stats in report["endpoints"].items():
+        replayed, recorded = stats["replayed_ms"], stats["recorded_ms"]
+        print(
+            f"{kind:<10}{stats['count']:>8}{stats['error_rate'] * 100:>7.1f}%"
+            f"{replayed['p50']:>9}{replayed['p90']:>9}{replayed['p99']:>9}{replayed['max']:>9}"
+            f"   {recorded['p50']}/{recorded['p99']}"
+        )
+        for error in stats["sample_errors"]:
+            print(f"    ✗ {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay recorded LTI traffic against a local instance"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prepare_parser = commands.add_parser(
+        "prepare", help="Write stub platform keys and tool config"
+    )
+    prepare_parser.add_argument("--trace", required=True)
+    prepare_parser.add_argument("--out", default="replay")
+    prepare_parser.add_argument("--stub-port", type=int, default=9001)
+
+    run_parser = commands.add_parser(
+        "run", help="Replay a trace and report latency/errors"
+    )
+    run_parser.add_argument("--trace", required=True)
+    run_parser.add_argument("--state", default="replay")
+    run_parser.add_argument("--target", default="http://127.0.0.1:5000")
+    run_parser.add_argument(
+        "--speed", type=float, default=1.0, help="1 = recorded pace"
+    )
+    run_parser.add_argument("--concurrency", type=int, default=64)
+    run_parser.add_argument(
+        "--platform-latency",
+        type=float,
+        default=0.0,
+        help="Seconds the stub platform waits before each response",
+    )
+    run_parser.add_argument(
+        "--report", help="Also write the report as JSON to this file"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "prepare":
+        config_path = prepare(args.trace, args.out, args.stub_port)
+        print(f"✓ Wrote {config_path}")
+        print(f"Start the tool with LTI_CONFIG_FILE={os.path.abspath(config_path)}")
+        return 0
+
+    records = load_trace(args.trace)
+    platform = StubPlatform(args.state, latency=args.platform_latency)
+    platform.start()
+    try:
+        replayer = Replayer(platform, args.target, args.speed, args.concurrency)
+        elapsed = replayer.run(records)
+    finally:
+        platform.stop()
+
+    report = build_report(records, replayer.samples, replayer.lags, elapsed)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())